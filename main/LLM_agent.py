@@ -3,23 +3,110 @@ LLM Agent module for TV recommendation system
 Handles intent classification, attribute extraction, and conversational responses
 """
 
-import json
+import asyncio
+import atexit
+import functools
+import logging
 import os
+import random
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Literal, Optional
 
+import httpx
+import orjson
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import NOT_GIVEN, AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+from pydantic import BaseModel, ConfigDict, ValidationError
 
-from bn_recommender import recommend_gender, recommend_type
+from bn_recommender import model_revision, recommend_gender, recommend_type, recommend_type_and_genre
+from llm_cache import ResponseCache
 
 # Load environment
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # --- OpenAI ---
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise RuntimeError("OPENAI_API_KEY not defined in .env file")
-client = OpenAI(api_key=api_key)
+# httpx closes idle connections after 5s by default, shorter than the time a
+# user takes to type the next message; keep them open across turns
+KEEPALIVE_EXPIRY = 120.0
+
+
+def _api_key() -> str:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY not defined in .env file")
+    return api_key
+
+
+# Clients are built on first use, so importing this module (colorize,
+# prompts, fast path...) needs neither an API key nor network setup.
+@functools.lru_cache(maxsize=1)
+def get_client() -> OpenAI:
+    """
+    Sync client (Flask API, sync helpers) on a persistent HTTP/2 keep-alive pool,
+    so the calls of a turn reuse one TLS session instead of re-handshaking
+    """
+    http_client = DefaultHttpxClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=16, max_keepalive_connections=8, keepalive_expiry=KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(30.0, connect=3.0),
+    )
+    client = OpenAI(api_key=_api_key(), http_client=http_client)
+    atexit.register(client.close)
+    return client
+
+
+@functools.lru_cache(maxsize=1)
+def get_aclient() -> AsyncOpenAI:
+    """
+    Async client for the CLI loop, where independent calls are awaited concurrently.
+    One long-lived HTTP/2 pool: TLS is negotiated once and the gathered calls
+    are multiplexed over the same connection.
+    """
+    async_http_client = DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32, keepalive_expiry=KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(30.0, connect=3.0),
+    )
+    return AsyncOpenAI(api_key=_api_key(), http_client=async_http_client)
+
+# --- Models ---
+# Intent and extraction are narrow JSON tasks: a small model is enough.
+# Only the user-facing conversation uses the larger model.
+INTENT_MODEL = os.getenv("INTENT_MODEL", "gpt-4o-mini")
+EXTRACTION_MODEL = os.getenv("EXTRACTION_MODEL", "gpt-4o-mini")
+CONVERSE_MODEL = os.getenv("CONVERSE_MODEL", "gpt-4o")
+
+# Output caps sized to each response: {"intent": ...} is ~10 tokens,
+# the attribute JSON ~80 and the converse JSON a short message
+INTENT_MAX_TOKENS = 24
+EXTRACTION_MAX_TOKENS = 160
+CONVERSE_MAX_TOKENS = 300
+
+# JSON mode for converse (guaranteed parseable reply). Set CONVERSE_JSON_MODE=0
+# for OpenAI-compatible proxies without response_format support (e.g. Gemini)
+CONVERSE_JSON_MODE = os.getenv("CONVERSE_JSON_MODE", "1") == "1"
+CONVERSE_RESPONSE_FORMAT = {"type": "json_object"} if CONVERSE_JSON_MODE else NOT_GIVEN
+
+# Routes every converse request to the same prompt-cache shard (shared SYSTEM_PROMPT prefix)
+PROMPT_CACHE_KEY = "tv-assistant-v1"
+
+# --- History window ---
+# Once history exceeds HISTORY_MAX messages, everything but the last
+# HISTORY_KEEP is folded into one "Summary:" system message by a cheap model
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_MAX_TOKENS = 120
+HISTORY_KEEP = 12
+HISTORY_MAX = 20
+
+# --- Response cache for the temperature=0 calls (intent + extraction) ---
+# Set LLM_CACHE_PATH to persist cached responses across runs
+response_cache = ResponseCache(maxsize=4096, path=os.getenv("LLM_CACHE_PATH"))
+atexit.register(response_cache.close)
 
 # --- MasOrange API ---
 # api_key = os.getenv("MO_API_KEY")
@@ -31,7 +118,8 @@ client = OpenAI(api_key=api_key)
 #     base_url="https://llm.tools.cloud.masorange.es",
 # )
 
-# ANSI colors
+# ANSI colors (only on a terminal; NO_COLOR=1 turns them off, see no-color.org)
+COLOR_ENABLED = sys.stdout.isatty() and "NO_COLOR" not in os.environ
 COLOR_RESET = "\033[0m"
 ACTION_COLORS = {
     "RECOMMEND": "\033[92m",
@@ -53,7 +141,7 @@ BN_LOG_COLOR = "\033[90m"
 
 def colorize(text: str, color_code: str) -> str:
     """Add ANSI color codes to text"""
-    if not color_code:
+    if not (COLOR_ENABLED and color_code):
         return text
     return f"{color_code}{text}{COLOR_RESET}"
 
@@ -62,156 +150,226 @@ def colorize(text: str, color_code: str) -> str:
 # SYSTEM PROMPTS
 # ============================================================================
 
-SYSTEM_PROMPT = """
-Eres un asistente de televisión diseñado para ayudar a personas mayores a decidir qué ver.
-Tu comportamiento depende del state que recibirás en cada turno.
+SYSTEM_PROMPT = """\
+Eres un asistente de televisión que ayuda a personas mayores a decidir qué ver.
+Cada turno recibes un STATE con: atributes_bn, candidates (ProgramType, ProgramGenre, type_ranking, genre_ranking), last_recommendation, user_feedback ("accepted"/"rejected"), real_content (títulos reales disponibles) y content_available.
 
-El state contiene:
-- atributes_bn (atributos extraídos para el BN)
-- candidatos del recomendador (ProgramType, ProgramGenre, rankings)
-- la última recomendación del turno anterior
-- feedback del usuario ("accepted" o "rejected")
-- **real_content**: lista de contenidos reales disponibles (películas/series con títulos reales)
-- **content_available**: boolean que indica si hay contenido real disponible
+Si content_available = true:
+- Recomienda TÍTULOS de real_content: "Te recomiendo [TÍTULO], [descripción breve]", con detalles útiles (rating, año, si está en español).
+- Si el usuario rechaza, ofrece el siguiente contenido de la lista.
+- Si pide más datos de un título, responde como SMALLTALK usando solo real_content.
+Si content_available = false:
+- Recomienda por género ("Te recomiendo ver algo de comedia"), explica que ahora no puedes sugerir títulos concretos y ofrece alternativas de type_ranking y genre_ranking.
 
-COMPORTAMIENTO SEGÚN DISPONIBILIDAD DE CONTENIDO:
+Nunca inventes títulos fuera de real_content. Usa un lenguaje cercano, sencillo y sin tecnicismos.
 
-Si content_available = true:
-- Usa TÍTULOS REALES de la lista real_content
-- Presenta el contenido de forma natural: "Te recomiendo [TÍTULO], es [descripción breve]"
-- Menciona detalles relevantes: rating, año, si está en español, etc.
-- Si el usuario rechaza, ofrece el siguiente contenido de la lista
-- Si pide más datos de la película/serie, proporciónalos como SMALLTALK (sin inventar, solo lo que esté en real_content)
+Responde SOLO con este JSON, sin markdown ni texto adicional:
+{"action": "RECOMMEND", "message": "Tu mensaje", "item": "Título o null", "content_id": 123}
+"""
 
-Si content_available = false:
-- Recomienda por GÉNERO genérico ("Te recomiendo ver algo de comedia")
-- Explica que puedes sugerir categorías pero no títulos específicos en este momento
-- Ofrece otros géneros alternativos de la lista type_ranking y genre_ranking
-- Mantén un tono positivo y útil
-
-IMPORTANTE:
-- NUNCA inventes títulos que no estén en real_content
-- Si no hay contenido real, sé honesto pero útil
-- Siempre ofrece alternativas (otros géneros, tipos)
-- Mantén un lenguaje cercano y amigable, adaptado a personas mayores
-- No uses tecnicismos innecesarios
-- RESPONDE SOLO EN FORMATO JSON, SIN TEXTO ADICIONAL
-
-FORMATO DE RESPUESTA OBLIGATORIO:
-Responde SIEMPRE con este JSON exacto, sin markdown, sin explicaciones:
-{
- "action": "RECOMMEND",
- "message": "Tu mensaje conversacional aquí",
- "item": "Título del contenido o null",
- "content_id": 123
-}
+INTENT_PROMPT = """\
+Clasifica la intención del mensaje. Responde SOLO con JSON: {"intent": "<INTENT>"}
+- FEEDBACK_NEG: expresa que algo NO le gusta (recomendación, género o tipo): "No me gusta el drama", "Esa no me gusta", "No me convence", "Ya la vi", "Me aburre".
+- FEEDBACK_POS: le gusta o lo acepta: "Me gusta", "Perfecto", "Vale", "La veo", "Esa sí".
+- ALTERNATIVE: pide algo diferente sin expresar gusto o disgusto directo: "Nada de terror", "No quiero ver comedias", "Dame otra", "Prefiero otra cosa", "¿Hay algo más?".
+- RECOMMEND: pide una recomendación: "Qué puedo ver", "Quiero ver comedia".
+- SMALLTALK: "Hola", "Gracias", "Adiós".
+- OTHER: todo lo demás.
+"""
 
-NUNCA AÑADAS:
-- Bloques de código ```json
-- Texto antes o después del JSON
-- Explicaciones adicionales
-- Markdown
+EXTRACTION_PROMPT = """\
+Extrae atributos para una Red Bayesiana. Responde SOLO con JSON con exactamente estas claves; usa null si un atributo no se menciona explícitamente y no inventes valores.
+UserAge: young (18-35) | adult (36-55) | senior (56+)
+UserGender: male | female
+HouseholdType: single | couple | family
+TimeOfDay: morning (07-12h) | afternoon (12-20h) | night (20-07h)
+DayType: weekday | weekend
+ProgramType: movie | series | news | documentary | entertainment
+ProgramGenre: comedy | drama | horror | romance | news | documentary | entertainment | action | thriller | sci-fi | fantasy
+ProgramDuration: short (<30 min) | medium (30-60 min) | long (>60 min)
+Ejemplo: "Quiero ver una comedia de 90 minutos" -> {"UserAge": null, "UserGender": null, "HouseholdType": null, "TimeOfDay": null, "DayType": null, "ProgramType": "movie", "ProgramGenre": "comedy", "ProgramDuration": "long"}
 """
 
-INTENT_PROMPT = """
-Eres un clasificador de intención. Devuelve SOLO un JSON válido, sin markdown ni bloques de código.
-
-REGLAS CRÍTICAS PARA CLASIFICACIÓN:
-
-1. FEEDBACK_NEG - Usuario expresa que algo NO le gusta (recomendación, género o tipo):
-   - "No me gusta [algo]" / "No me gustan [algo]"
-   - "No me convence" / "No me llama la atención"
-   - "Ya la vi" / "La he visto"
-   - "Me aburre" / "No es para mí"
-
-2. FEEDBACK_POS - Usuario expresa que algo SÍ le gusta o lo acepta:
-   - "Me gusta" / "Me gusta ese tipo"
-   - "Perfecto" / "Vale" / "De acuerdo"
-   - "La veo" / "Sí, la veo" / "Esa sí"
-
-3. ALTERNATIVE - Usuario pide o prefiere algo DIFERENTE (sin expresar gusto/disgusto directo) y si se aplica feedback negativo, debe pasar luego una alternativa:
-   - "Nada de [género]" / "Sin [género]" / "No quiero ver [género]"
-   - "Dame otra opción" / "Otra cosa" / "Algo diferente"
-   - "Prefiero otra cosa" / "Prefiero algo diferente"
-   - "¿Hay algo más?" / "¿No tienes otra cosa?"
-
-4. RECOMMEND - Pide nueva recomendación:
-   - "Qué puedo ver" / "Recomiéndame algo"
-   - "Quiero ver [tipo/género]"
-
-5. SMALLTALK - Conversación trivial:
-   - "Hola" / "Gracias" / "Adiós"
-
-6. OTHER - Todo lo demás
-
-EJEMPLOS CRÍTICOS:
-"No me gusta el drama" → FEEDBACK_NEG (expresa disgusto por el género)
-"No me gustan las comedias" → FEEDBACK_NEG (expresa disgusto por el género)
-"Esa no me gusta" → FEEDBACK_NEG (expresa disgusto por la recomendación)
-"Nada de terror" → ALTERNATIVE (pide algo diferente, sin usar "no me gusta")
-"No quiero ver comedias" → ALTERNATIVE (pide evitar ese género)
-"Dame otra" → ALTERNATIVE
-"Prefiero otra cosa" → ALTERNATIVE
-"Me gusta" → FEEDBACK_POS
-"Perfecto" → FEEDBACK_POS
-"Quiero ver comedia" → RECOMMEND
-
-Responde SOLO con:
-{
- "intent": "RECOMMEND"
+
+# ============================================================================
+# LOCAL INTENT FAST PATH
+# ============================================================================
+
+# Spanish/English genre words -> BN genre name (also used by smart_alternative)
+GENRE_SYNONYMS = {
+    "comedia": "comedy", "comedias": "comedy", "comedy": "comedy",
+    "drama": "drama", "dramas": "drama",
+    "terror": "horror", "miedo": "horror", "horror": "horror",
+    "romance": "romance", "romances": "romance", "romántico": "romance", "romántica": "romance",
+    "románticas": "romance", "románticos": "romance", "romantico": "romance", "romantica": "romance",
+    "acción": "action", "accion": "action", "action": "action",
+    "thriller": "thriller", "thrillers": "thriller", "suspense": "thriller",
+    "ciencia ficción": "sci-fi", "ciencia ficcion": "sci-fi", "sci-fi": "sci-fi",
+    "fantasía": "fantasy", "fantasia": "fantasy", "fantasy": "fantasy",
+    "documental": "documentary", "documentales": "documentary",
+    "noticias": "news", "informativos": "news", "telediario": "news",
+    "entretenimiento": "entertainment",
 }
 
-Sin bloques de código, sin markdown, sin texto adicional.
-"""
+# Content words accepted after "nada de": genre words, program types and their plurals
+_NADA_DE_WORDS = "|".join(
+    re.escape(word)
+    for word in sorted([*GENRE_SYNONYMS, "película", "pelicula", "peli", "serie", "programa"], key=len, reverse=True)
+)
+
+# Whole-message rules for trivial turns; anything else goes to the LLM.
+# Rules only match the complete (normalized) message so that sentences like
+# "No me gusta el drama" or "Quiero ver comedia" are never short-circuited.
+FAST_INTENT_RULES = [
+    (re.compile(r"(hola|buenas( tardes| noches)?|buenos d[ií]as|(muchas )?gracias|adi[oó]s|hasta luego)"), "SMALLTALK"),
+    (re.compile(r"(perfecto|vale|de acuerdo|genial|me gusta|(s[ií],? )?la veo|esa s[ií])"), "FEEDBACK_POS"),
+    (re.compile(r"(no me convence|no me llama la atenci[oó]n|ya la vi|la he visto|me aburre|no es para m[ií])"), "FEEDBACK_NEG"),
+    (re.compile(r"((dame|pon) otra( opci[oó]n| cosa)?|otra( opci[oó]n| cosa)?|algo diferente"
+                r"|prefiero (ver )?(otra cosa|algo diferente)|hay algo m[aá]s|no tienes otra cosa"
+                r"|(no )?esa no|no esa|c[aá]mbia(la|lo)?( por otra)?|siguiente"
+                rf"|nada de (?:{_NADA_DE_WORDS})(?:e?s)?( por favor)?)"), "ALTERNATIVE"),
+]
+
+_FAST_INTENT_STRIP = re.compile(r"[¿?¡!.,;:]+")
+
+
+def normalize_message(user_message: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace ("¡Hola!" -> "hola")"""
+    text = _FAST_INTENT_STRIP.sub(" ", user_message.lower())
+    return " ".join(text.split())
+
+
+def fast_classify_intent(user_message: str):
+    """
+    Classify trivial messages locally without calling the LLM
+
+    Returns:
+        Intent string, or None if the message needs the LLM classifier
+    """
+    text = normalize_message(user_message)
+
+    for pattern, intent in FAST_INTENT_RULES:
+        if pattern.fullmatch(text):
+            return intent
+    return None
 
-EXTRACTION_PROMPT = """
-Eres un modelo extractor de atributos para una Red Bayesiana.
-Devuelve SOLO un JSON válido con los siguientes campos EXACTOS, sin markdown ni bloques de código:
-
-{
-  "UserAge": ...,
-  "UserGender": ...,
-  "HouseholdType": ...,
-  "TimeOfDay": ...,
-  "DayType": ...,
-  "ProgramType": ...,
-  "ProgramGenre": ...,
-  "ProgramDuration": ...
+
+# ============================================================================
+# TEMPLATED REPLIES
+# ============================================================================
+
+# Canned answers for trivial turns that bring no new content to present,
+# so no converse call is needed for them
+TEMPLATE_REPLIES = {
+    "greeting": [
+        "¡Hola! ¿Qué te apetece ver hoy?",
+        "¡Buenas! ¿Te ayudo a encontrar algo para ver?",
+    ],
+    "thanks": [
+        "¡De nada! Si te apetece ver otra cosa, aquí estoy.",
+        "¡A ti! Avísame si quieres otra recomendación.",
+    ],
+    "bye": [
+        "¡Hasta luego! Que disfrutes de la tele.",
+        "¡Adiós! Aquí estaré cuando quieras ver algo.",
+    ],
+    "accepted": [
+        "¡Estupendo! Que disfrutes de {title}.",
+        "¡Me alegro! Espero que te guste {title}.",
+    ],
+    "accepted_genre": [
+        "¡Estupendo! Que lo disfrutes.",
+        "¡Me alegro! Espero que te guste.",
+    ],
 }
 
-Reglas estrictas:
-- Si un atributo no se menciona explícitamente, usa null.
-- No inventes valores.
-- No añadas texto fuera del JSON.
-- No uses markdown ni bloques de código (```).
-- Usa EXACTAMENTE los nombres de los campos indicados (respeta mayúsculas).
-
-Convenciones de valores:
-
-UserAge: "young" (18-35) | "adult" (36-55) | "senior" (56+)
-UserGender: "male" | "female"
-HouseholdType: "single" | "couple" | "family"
-TimeOfDay: "morning" (07:00-12:00) | "afternoon" (12:00-20:00) | "night" (20:00-07:00)
-DayType: "weekday" | "weekend"
-ProgramType: "movie" | "series" | "news" | "documentary" | "entertainment"
-ProgramGenre: "comedy" | "drama" | "horror" | "romance" | "news" | "documentary" | "entertainment" | "action" | "thriller" | "sci-fi" | "fantasy"
-ProgramDuration: "short" (<30 min) | "medium" (30-60 min) | "long" (>60 min)
-
-EJEMPLOS:
-Input: "Quiero ver una comedia de 90 minutos"
-Output: {"UserAge": null, "UserGender": null, "HouseholdType": null, "TimeOfDay": null, "DayType": null, "ProgramType": "movie", "ProgramGenre": "comedy", "ProgramDuration": "long"}
-
-Input: "Soy un chico de 32 años"
-Output: {"UserAge": "young", "UserGender": "male", "HouseholdType": null, "TimeOfDay": null, "DayType": null, "ProgramType": null, "ProgramGenre": null, "ProgramDuration": null}
-"""
+_SMALLTALK_KINDS = [
+    (re.compile(r"(muchas )?gracias"), "thanks"),
+    (re.compile(r"adi[oó]s|hasta luego"), "bye"),
+]
+
+
+def templated_reply(user_message: str, intent: str, state: dict):
+    """
+    Reply without the LLM to trivial SMALLTALK / FEEDBACK_POS turns
+    (messages fully matched by the local fast path)
+
+    Returns:
+        Dict with action, message, item, or None if converse is needed
+    """
+    if intent not in ("SMALLTALK", "FEEDBACK_POS") or fast_classify_intent(user_message) != intent:
+        return None
+
+    if intent == "SMALLTALK":
+        text = normalize_message(user_message)
+        kind = next((k for pattern, k in _SMALLTALK_KINDS if pattern.fullmatch(text)), "greeting")
+        return {"action": "SMALLTALK", "message": random.choice(TEMPLATE_REPLIES[kind]), "item": None}
+
+    content = (state.get("last_recommendation") or {}).get("content") or {}
+    title = content.get("title")
+    if title:
+        message = random.choice(TEMPLATE_REPLIES["accepted"]).format(title=title)
+    else:
+        message = random.choice(TEMPLATE_REPLIES["accepted_genre"])
+    return {"action": "FEEDBACK", "message": message, "item": title}
 
 
 # ============================================================================
 # LLM FUNCTIONS
 # ============================================================================
 
+INTENTS = ["RECOMMEND", "ALTERNATIVE", "FEEDBACK_POS", "FEEDBACK_NEG", "SMALLTALK", "OTHER"]
+
+# Structured outputs: the intent is constrained to the enum at decode time
+INTENT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "intent",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"intent": {"type": "string", "enum": INTENTS}},
+            "required": ["intent"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+class BNAttrs(BaseModel):
+    """Attributes extracted for the BN; None when the message does not mention them"""
+    model_config = ConfigDict(extra="forbid")
+
+    UserAge: Optional[Literal["young", "adult", "senior"]]
+    UserGender: Optional[Literal["male", "female"]]
+    HouseholdType: Optional[Literal["single", "couple", "family"]]
+    TimeOfDay: Optional[Literal["morning", "afternoon", "night"]]
+    DayType: Optional[Literal["weekday", "weekend"]]
+    ProgramType: Optional[Literal["movie", "series", "news", "documentary", "entertainment"]]
+    ProgramGenre: Optional[Literal[
+        "comedy", "drama", "horror", "romance", "news", "documentary",
+        "entertainment", "action", "thriller", "sci-fi", "fantasy",
+    ]]
+    ProgramDuration: Optional[Literal["short", "medium", "long"]]
+
+
+# Every attribute is constrained to the BN state names at decode time
+EXTRACTION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "BNAttrs",
+        "strict": True,
+        "schema": BNAttrs.model_json_schema(),
+    },
+}
+
+
 def clean_json_response(text: str) -> str:
-    """Clean JSON response from markdown and extra text"""
+    """
+    Clean JSON response from markdown and extra text.
+    Not needed for the JSON-mode calls below; kept for providers without
+    response_format support (e.g. the evaluation notebook's proxy client).
+    """
     text = text.strip()
     
     # Remove markdown code blocks
@@ -231,6 +389,99 @@ def clean_json_response(text: str) -> str:
     return text.strip()
 
 
+def _intent_messages(user_message: str) -> list:
+    return [
+        {"role": "system", "content": INTENT_PROMPT},
+        {"role": "user", "content": user_message}
+    ]
+
+
+def _parse_json(content: str, label: str):
+    """Parse a JSON response, returning None if it is malformed"""
+    try:
+        return orjson.loads(content)
+    except orjson.JSONDecodeError as e:
+        logger.warning("Error parsing %s JSON: %s\nRaw response: %s", label, e, content)
+        return None
+
+
+def _intent_key(user_message: str) -> str:
+    return response_cache.make_key(INTENT_MODEL, INTENT_PROMPT, normalize_message(user_message))
+
+
+def _intent_from_response(key: str, content: str) -> str:
+    data = _parse_json(content, "intent")
+    if data is None:
+        return "OTHER"
+
+    intent = data.get("intent", "OTHER")
+    response_cache.set(key, intent)
+    return intent
+
+
+def _extraction_messages(user_message: str) -> list:
+    return [
+        {"role": "system", "content": EXTRACTION_PROMPT},
+        {"role": "user", "content": user_message}
+    ]
+
+
+def _extraction_key(user_message: str) -> str:
+    return response_cache.make_key(EXTRACTION_MODEL, EXTRACTION_PROMPT, normalize_message(user_message))
+
+
+def _attributes_from_response(key: str, content: str) -> dict:
+    try:
+        data = BNAttrs.model_validate_json(content).model_dump()
+    except ValidationError as e:
+        logger.warning("Error validating extraction JSON: %s\nRaw response: %s", e, content)
+        return {}
+
+    response_cache.set(key, data)
+    return data
+
+
+def compact_state(state: dict) -> dict:
+    """Drop empty values (None, "", [], {}) so they cost no prompt tokens"""
+    compact = {}
+    for key, value in state.items():
+        if isinstance(value, dict):
+            value = compact_state(value)
+        if value is None or value == "" or value == [] or value == {}:
+            continue
+        compact[key] = value
+    return compact
+
+
+def _converse_messages(user_message: str, state: dict, history: list = None) -> list:
+    """
+    Build the converse messages with the static part first.
+
+    OpenAI caches the longest repeated prompt prefix, so the byte-identical
+    SYSTEM_PROMPT and the append-only history go first and the per-turn
+    STATE goes last, right before the user message.
+    """
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+
+    if history:
+        messages.extend(history)
+
+    # Compact JSON: fewer prompt tokens than indent=2; orjson keeps UTF-8 as is (like ensure_ascii=False)
+    state_blob = orjson.dumps(compact_state(state), default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    messages.append({"role": "system", "content": "STATE:\n" + state_blob})
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+def _log_prompt_cache(usage) -> None:
+    """Log (at debug level) how many prompt tokens were served from OpenAI's prompt cache"""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) or 0
+    logger.debug("Prompt tokens: %s (cached: %s)", usage.prompt_tokens, cached)
+
+
 def classify_intent(user_message: str) -> str:
     """
     Classify the user's intent using GPT-4
@@ -238,26 +489,25 @@ def classify_intent(user_message: str) -> str:
     Returns:
         Intent string: RECOMMEND, ALTERNATIVE, FEEDBACK_POS, FEEDBACK_NEG, SMALLTALK, OTHER
     """
-    resp = client.chat.completions.create(
-        model="gpt-4o",
+    fast_intent = fast_classify_intent(user_message)
+    if fast_intent:
+        return fast_intent
+
+    key = _intent_key(user_message)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    resp = get_client().chat.completions.create(
+        model=INTENT_MODEL,
         #model="gemini-2.5-pro",
-        messages=[
-            {"role": "system", "content": INTENT_PROMPT},
-            {"role": "user", "content": user_message}
-        ],
-        temperature=0
+        messages=_intent_messages(user_message),
+        temperature=0,
+        response_format=INTENT_RESPONSE_FORMAT,
+        max_tokens=INTENT_MAX_TOKENS,
     )
     
-    content = resp.choices[0].message.content
-    content = clean_json_response(content)
-    
-    try:
-        data = json.loads(content)
-        return data["intent"]
-    except json.JSONDecodeError as e:
-        print(f"Error parsing intent JSON: {e}")
-        print(f"Raw response: {content}")
-        return "OTHER"
+    return _intent_from_response(key, resp.choices[0].message.content)
 
 
 def extract_attributes_llm(user_message: str) -> dict:
@@ -267,28 +517,24 @@ def extract_attributes_llm(user_message: str) -> dict:
     Returns:
         Dictionary with BN attribute names and values
     """
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    key = _extraction_key(user_message)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    response = get_client().chat.completions.create(
+        model=EXTRACTION_MODEL,
         #model="claude-sonnet-4-5",
-        messages=[
-            {"role": "system", "content": EXTRACTION_PROMPT},
-            {"role": "user", "content": user_message}
-        ],
-        temperature=0
+        messages=_extraction_messages(user_message),
+        temperature=0,
+        response_format=EXTRACTION_RESPONSE_FORMAT,
+        max_tokens=EXTRACTION_MAX_TOKENS,
     )
     
-    content = response.choices[0].message.content
-    content = clean_json_response(content)
-    
-    try:
-        return json.loads(content)
-    except json.JSONDecodeError as e:
-        print(f"Error parsing extraction JSON: {e}")
-        print(f"Raw response: {content}")
-        return {}
+    return _attributes_from_response(key, response.choices[0].message.content)
 
 
-def converse(user_message: str, state: dict, history: list = None) -> str:
+def converse(user_message: str, state: dict, history: list = None, force_json: bool = False) -> str:
     """
     Generate conversational response using GPT-4
     
@@ -296,45 +542,328 @@ def converse(user_message: str, state: dict, history: list = None) -> str:
         user_message: User's input
         state: Current system state with BN results and content
         history: Conversation history
+        force_json: Retry mode after an unparseable reply (temperature 0, JSON mode)
         
     Returns:
         JSON string with action, message, item, content_id
     """
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "system", "content": "STATE:\n" + json.dumps(state, indent=2, ensure_ascii=False, default=str)}
+    response = get_client().chat.completions.create(
+        model=CONVERSE_MODEL,
+        #model="claude-sonnet-4-5",
+        messages=_converse_messages(user_message, state, history),
+        temperature=0 if force_json else 0.3,  # Lower temperature for more consistent JSON
+        max_tokens=CONVERSE_MAX_TOKENS,
+        prompt_cache_key=PROMPT_CACHE_KEY,
+        response_format={"type": "json_object"} if force_json else CONVERSE_RESPONSE_FORMAT,
+    )
+    _log_prompt_cache(response.usage)
+
+    return response.choices[0].message.content
+
+
+# Worker threads for overlapping sync calls (the sync client is thread-safe)
+_llm_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="llm")
+
+
+def classify_and_extract(user_message: str) -> tuple:
+    """
+    Sync counterpart of aclassify_and_extract for the Flask API:
+    extraction runs on a worker thread while the intent is classified here.
+
+    Returns:
+        Tuple of (intent, attributes)
+    """
+    # Locally classified messages are never RECOMMEND: nothing to extract
+    fast_intent = fast_classify_intent(user_message)
+    if fast_intent:
+        return fast_intent, {}
+
+    extraction = _llm_pool.submit(extract_attributes_llm, user_message)
+    intent = classify_intent(user_message)
+    return intent, extraction.result()
+
+
+SUMMARY_PROMPT = """
+Summarize this conversation between a user and a TV recommendation assistant in at most 80 tokens.
+Keep what matters for future recommendations: stated preferences (type, genre, audience, mood),
+titles already recommended and whether they were accepted or rejected.
+Write in the user's language. Output plain text only.
+"""
+
+
+def _summary_messages(old_messages: list) -> list:
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in old_messages)
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": transcript},
     ]
 
-    if history:
-        messages.extend(history)
 
-    messages.append({"role": "user", "content": user_message})
+def _replace_with_summary(history: list, summary: str) -> None:
+    history[:] = [{"role": "system", "content": f"Summary: {summary.strip()}"}] + history[-HISTORY_KEEP:]
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        #model="claude-sonnet-4-5",
-        messages=messages,
-        temperature=0.3,  # Lower temperature for more consistent JSON
-        # response_format={"type": "json_object"}  # Not supported by Gemini via proxy
+
+def compact_history(history: list) -> None:
+    """
+    Keep the history sent to converse bounded (in place).
+    Older turns, including any previous summary, are condensed into one
+    system message so prefill cost stays flat over a long session.
+    """
+    if len(history) <= HISTORY_MAX:
+        return
+
+    response = get_client().chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=_summary_messages(history[:-HISTORY_KEEP]),
+        temperature=0,
+        max_tokens=SUMMARY_MAX_TOKENS,
+    )
+    _replace_with_summary(history, response.choices[0].message.content)
+
+
+# ============================================================================
+# ASYNC LLM FUNCTIONS
+# ============================================================================
+
+async def aclassify_intent(user_message: str) -> str:
+    """Async version of classify_intent (uses the AsyncOpenAI client)"""
+    fast_intent = fast_classify_intent(user_message)
+    if fast_intent:
+        return fast_intent
+
+    key = _intent_key(user_message)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    resp = await get_aclient().chat.completions.create(
+        model=INTENT_MODEL,
+        messages=_intent_messages(user_message),
+        temperature=0,
+        response_format=INTENT_RESPONSE_FORMAT,
+        max_tokens=INTENT_MAX_TOKENS,
+    )
+
+    return _intent_from_response(key, resp.choices[0].message.content)
+
+
+async def aextract_attributes_llm(user_message: str) -> dict:
+    """Async version of extract_attributes_llm (uses the AsyncOpenAI client)"""
+    key = _extraction_key(user_message)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    response = await get_aclient().chat.completions.create(
+        model=EXTRACTION_MODEL,
+        messages=_extraction_messages(user_message),
+        temperature=0,
+        response_format=EXTRACTION_RESPONSE_FORMAT,
+        max_tokens=EXTRACTION_MAX_TOKENS,
+    )
+
+    return _attributes_from_response(key, response.choices[0].message.content)
+
+
+async def aconverse(user_message: str, state: dict, history: list = None, force_json: bool = False) -> str:
+    """Async version of converse (uses the AsyncOpenAI client)"""
+    response = await get_aclient().chat.completions.create(
+        model=CONVERSE_MODEL,
+        messages=_converse_messages(user_message, state, history),
+        temperature=0 if force_json else 0.3,
+        max_tokens=CONVERSE_MAX_TOKENS,
+        prompt_cache_key=PROMPT_CACHE_KEY,
+        response_format={"type": "json_object"} if force_json else CONVERSE_RESPONSE_FORMAT,
     )
+    _log_prompt_cache(response.usage)
 
     return response.choices[0].message.content
 
 
+class MessageFieldStreamer:
+    """
+    Incrementally decode the "message" string of a JSON response while it is
+    being streamed, so the text can be shown before the JSON is complete.
+    """
+
+    _MESSAGE_KEY = re.compile(r'"message"\s*:\s*"')
+    _ACTION_KEY = re.compile(r'"action"\s*:\s*"([A-Za-z_]+)"')
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self):
+        self.buffer = ""
+        self.action = None
+        self._pos = None      # index of the next unread char of the message value
+        self._done = False
+
+    def feed(self, chunk: str) -> str:
+        """Add a streamed chunk and return the newly decoded message text"""
+        self.buffer += chunk
+
+        if self.action is None:
+            m = self._ACTION_KEY.search(self.buffer)
+            if m:
+                self.action = m.group(1)
+
+        if self._done:
+            return ""
+
+        if self._pos is None:
+            m = self._MESSAGE_KEY.search(self.buffer)
+            if not m:
+                return ""
+            self._pos = m.end()
+
+        out = []
+        buf = self.buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self._done = True
+                i += 1
+                break
+            if ch != "\\":
+                out.append(ch)
+                i += 1
+                continue
+
+            # Escape sequence: wait for the rest of it if incomplete
+            if i + 1 >= len(buf):
+                break
+            esc = buf[i + 1]
+            if esc == "u":
+                if i + 6 > len(buf):
+                    break
+                code = int(buf[i + 2:i + 6], 16)
+                if 0xD800 <= code < 0xDC00:
+                    # High surrogate: combine with the following \uXXXX
+                    if i + 12 > len(buf):
+                        break
+                    low = int(buf[i + 8:i + 12], 16)
+                    code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                    i += 6
+                out.append(chr(code))
+                i += 6
+            else:
+                out.append(self._ESCAPES.get(esc, esc))
+                i += 2
+
+        self._pos = i
+        return "".join(out)
+
+
+async def aconverse_stream(user_message: str, state: dict, history: list = None, on_delta=None) -> str:
+    """
+    Streaming version of aconverse.
+
+    Args:
+        on_delta: Callback(text, action) called with each new piece of the
+                  "message" field as soon as it arrives
+
+    Returns:
+        The complete JSON string (same as aconverse)
+    """
+    stream = await get_aclient().chat.completions.create(
+        model=CONVERSE_MODEL,
+        messages=_converse_messages(user_message, state, history),
+        temperature=0.3,
+        max_tokens=CONVERSE_MAX_TOKENS,
+        prompt_cache_key=PROMPT_CACHE_KEY,
+        response_format=CONVERSE_RESPONSE_FORMAT,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+
+    streamer = MessageFieldStreamer()
+    parts = []
+    async for chunk in stream:
+        if not chunk.choices:
+            # Final chunk carries only the usage stats
+            _log_prompt_cache(chunk.usage)
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+
+        parts.append(delta)
+        text = streamer.feed(delta)
+        if text and on_delta:
+            on_delta(text, streamer.action)
+
+    return "".join(parts)
+
+
+async def acompact_history(history: list) -> None:
+    """Async version of compact_history (uses the AsyncOpenAI client)"""
+    if len(history) <= HISTORY_MAX:
+        return
+
+    response = await get_aclient().chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=_summary_messages(history[:-HISTORY_KEEP]),
+        temperature=0,
+        max_tokens=SUMMARY_MAX_TOKENS,
+    )
+    _replace_with_summary(history, response.choices[0].message.content)
+
+
+async def aclose_clients() -> None:
+    """Close the async HTTP pool (if it was created); call from the same event loop that used it"""
+    if get_aclient.cache_info().currsize:
+        await get_aclient().close()
+
+
+async def aclassify_and_extract(user_message: str) -> tuple:
+    """
+    Run intent classification and attribute extraction concurrently.
+    Both only depend on the raw user message, so the two round-trips overlap.
+    The extracted attributes are only meaningful when intent == "RECOMMEND".
+
+    Returns:
+        Tuple of (intent, attributes)
+    """
+    # Locally classified messages are never RECOMMEND: nothing to extract
+    fast_intent = fast_classify_intent(user_message)
+    if fast_intent:
+        return fast_intent, {}
+
+    intent, attributes = await asyncio.gather(
+        aclassify_intent(user_message),
+        aextract_attributes_llm(user_message),
+    )
+    return intent, attributes
+
+
 # ============================================================================
 # BN INFERENCE
 # ============================================================================
 
+# Values the extractor uses for "not mentioned"
+_SENTINELS = frozenset((None, "", "null"))
+
+# BN trace logs (DEBUG_BN=0 silences them and skips the string formatting)
+DEBUG_BN = os.getenv("DEBUG_BN", "1") != "0"
+
+
 def recommend_by_genre(state: dict) -> dict:
     """
     Extract non-null attributes for BN inference
     """
     attrs = state.get("atributes_bn") or {}
-    filtered = {k: v for k, v in attrs.items() if v not in (None, "", "null")}
-    print(colorize(f"Non-null attributes for BN: {filtered}", BN_LOG_COLOR))
+    if any(v in _SENTINELS for v in attrs.values()):
+        filtered = {k: v for k, v in attrs.items() if v not in _SENTINELS}
+    else:
+        filtered = attrs  # nothing to drop (read-only downstream)
+    if DEBUG_BN:
+        print(colorize(f"Non-null attributes for BN: {filtered}", BN_LOG_COLOR))
     return filtered
 
 
+# Rankings per (model, CPD revision, attributes); "otra opción" turns repeat the same evidence
+bn_cache = ResponseCache(maxsize=512)
+
+
 def infer_with_bn(state: dict, model) -> dict:
     """
     Run BN inference to get Type and Genre recommendations.
@@ -346,42 +875,80 @@ def infer_with_bn(state: dict, model) -> dict:
     """
     attrs = recommend_by_genre(state)
     if not attrs:
-        print(colorize("Not enough attributes for BN inference.", BN_LOG_COLOR))
+        if DEBUG_BN:
+            print(colorize("Not enough attributes for BN inference.", BN_LOG_COLOR))
         return {}
 
+    key = ResponseCache.make_key(
+        str(id(model)),
+        str(model_revision(model)),
+        *(f"{k}={v}" for k, v in sorted(attrs.items())),
+    )
+    cached = bn_cache.get(key)
+    if cached is not None:
+        if DEBUG_BN:
+            print(colorize(
+                f"Final decision (cached): Type={cached['ProgramType']} | Genre={cached['ProgramGenre']}",
+                BN_LOG_COLOR
+            ))
+        return cached
+
+    result = _infer_core(attrs, model)
+    bn_cache.set(key, result)
+    return result
+
+
+def _infer_core(attrs: dict, model) -> dict:
+    """
+    Type/Genre inference for already-filtered attributes
+    """
     user_type  = attrs.get("ProgramType")
     user_genre = attrs.get("ProgramGenre")
 
-    # ── ProgramType ──────────────────────────────────────────────────────────
-    if user_type:
-        # User already specified the type: use it directly, skip inference
-        chosen_type = user_type
-        type_ranking = [user_type]
-        print(colorize(f"ProgramType provided by user: {chosen_type}", BN_LOG_COLOR))
-    else:
-        type_recs = recommend_type(attrs, model)
-        chosen_type = type_recs[0][0]
+    if not user_type and not user_genre:
+        # Neither given: a single joint BN query yields both rankings
+        type_recs, genre_recs = recommend_type_and_genre(attrs, model)
         type_ranking = [t[0] for t in type_recs]
-        print(colorize(f"Type recommendations (BN): {type_ranking}", BN_LOG_COLOR))
-
-    # ── ProgramGenre ─────────────────────────────────────────────────────────
-    if user_genre:
-        # User already specified the genre: use it directly, skip inference
-        chosen_genre = user_genre
-        genre_ranking = [user_genre]
-        print(colorize(f"ProgramGenre provided by user: {chosen_genre}", BN_LOG_COLOR))
-    else:
-        attrs_with_type = dict(attrs)
-        attrs_with_type["ProgramType"] = chosen_type
-        genre_recs = recommend_gender(attrs_with_type, model)
-        chosen_genre = genre_recs[0][0]
         genre_ranking = [g[0] for g in genre_recs]
-        print(colorize(f"Genre recommendations (BN): {genre_ranking}", BN_LOG_COLOR))
-
-    print(colorize(
-        f"Final decision: Type={chosen_type} | Genre={chosen_genre}",
-        BN_LOG_COLOR
-    ))
+        chosen_type = type_ranking[0]
+        chosen_genre = genre_ranking[0]
+        if DEBUG_BN:
+            print(colorize(f"Type recommendations (BN): {type_ranking}", BN_LOG_COLOR))
+            print(colorize(f"Genre recommendations (BN): {genre_ranking}", BN_LOG_COLOR))
+    else:
+        # ── ProgramType ──────────────────────────────────────────────────────
+        if user_type:
+            # User already specified the type: use it directly, skip inference
+            chosen_type = user_type
+            type_ranking = [user_type]
+            if DEBUG_BN:
+                print(colorize(f"ProgramType provided by user: {chosen_type}", BN_LOG_COLOR))
+        else:
+            type_ranking = [t[0] for t in recommend_type(attrs, model)]
+            chosen_type = type_ranking[0]
+            if DEBUG_BN:
+                print(colorize(f"Type recommendations (BN): {type_ranking}", BN_LOG_COLOR))
+
+        # ── ProgramGenre ─────────────────────────────────────────────────────
+        if user_genre:
+            # User already specified the genre: use it directly, skip inference
+            chosen_genre = user_genre
+            genre_ranking = [user_genre]
+            if DEBUG_BN:
+                print(colorize(f"ProgramGenre provided by user: {chosen_genre}", BN_LOG_COLOR))
+        else:
+            attrs_with_type = dict(attrs)
+            attrs_with_type["ProgramType"] = chosen_type
+            genre_ranking = [g[0] for g in recommend_gender(attrs_with_type, model)]
+            chosen_genre = genre_ranking[0]
+            if DEBUG_BN:
+                print(colorize(f"Genre recommendations (BN): {genre_ranking}", BN_LOG_COLOR))
+
+    if DEBUG_BN:
+        print(colorize(
+            f"Final decision: Type={chosen_type} | Genre={chosen_genre}",
+            BN_LOG_COLOR
+        ))
 
     return {
         "ProgramType":   chosen_type,
@@ -395,6 +962,15 @@ def infer_with_bn(state: dict, model) -> dict:
 # UTILITIES
 # ============================================================================
 
+# hour -> time of day (morning 7-11, afternoon 12-19, night otherwise)
+_HOUR_TO_TOD = tuple(
+    "morning" if 7 <= h < 12 else "afternoon" if 12 <= h < 20 else "night"
+    for h in range(24)
+)
+# weekday() -> day type (Mon-Fri weekday, Sat-Sun weekend)
+_WD_TO_DT = ("weekday",) * 5 + ("weekend",) * 2
+
+
 def get_time_daytype() -> tuple:
     """
     Get current time of day and day type
@@ -403,19 +979,4 @@ def get_time_daytype() -> tuple:
         Tuple of (time_of_day, day_type)
     """
     now = datetime.now()
-    hour = now.hour
-    weekday = now.weekday()
-
-    if 7 <= hour < 12:
-        time_of_day = "morning"
-    elif 12 <= hour < 20:
-        time_of_day = "afternoon"
-    else:
-        time_of_day = "night"
-
-    if weekday < 5:
-        day_type = "weekday"
-    else:
-        day_type = "weekend"
-
-    return time_of_day, day_type
\ No newline at end of file
+    return _HOUR_TO_TOD[now.hour], _WD_TO_DT[now.weekday()]
\ No newline at end of file
@@ -8,20 +8,23 @@ Coloca este archivo en la misma carpeta que main.py y ejecuta:
 
 import json
 from pathlib import Path
+
+import orjson
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 
-from feedback import initialize_cpt_counts, apply_feedback, load_cpt_counts, save_cpt_counts
+from feedback import initialize_cpt_counts, apply_feedback, load_cpt_counts, refresh_model_cpd, save_cpt_counts
 from main.bn_builder import load_model
 from LLM_agent import (
-    classify_intent,
+    classify_and_extract,
+    compact_history,
     converse,
-    extract_attributes_llm,
     get_time_daytype,
     infer_with_bn,
+    templated_reply,
 )
 from content_fetcher import TMDBContentFetcher
-from smart_alternative import should_skip_to_next_genre, get_next_different_genre
+from smart_alternative import should_skip_to_next_genre, get_next_different_genre, ranking_position
 from main import fetch_real_content, try_next_alternative
 
 # ════════════════════════════════════════════════════════════════
@@ -84,14 +87,18 @@ def save_profile():
 
 # Modelo Bayesiano
 MODEL_PATH  = Path(__file__).parent / "output/model.pkl"
+MODEL_DIR   = Path(__file__).parent / "output/model"
 COUNTS_PATH = Path(__file__).parent / "output/cpt_counts.json"
 
-model      = load_model(str(MODEL_PATH))
+model      = load_model(str(MODEL_DIR if MODEL_DIR.exists() else MODEL_PATH))
 cpt_counts = initialize_cpt_counts(model, virtual_sample_size=100)
 
 if COUNTS_PATH.exists():
     try:
         cpt_counts = load_cpt_counts(COUNTS_PATH)
+        # Rebuild CPDs from loaded counts and apply to model
+        for var, cpt_info in cpt_counts.items():
+            refresh_model_cpd(model, var, cpt_info)
         print("✅ Datos de aprendizaje cargados")
     except Exception as e:
         print(f"⚠️  No se pudieron cargar los counts: {e}")
@@ -134,13 +141,13 @@ def chat():
     if not mensaje:
         return jsonify({"error": "Campo 'message' vacío"}), 400
 
-    # ── 1. Clasificar intención ──────────────────────────────────
-    intent = classify_intent(mensaje)
+    # ── 1. Clasificar intención (y extraer atributos en paralelo) ─
+    intent, extracted = classify_and_extract(mensaje)
     print(f"[intent] {intent}")
 
     # ── 2. Lógica según intención ────────────
     if intent == "RECOMMEND":
-        atributes = extract_attributes_llm(mensaje)
+        atributes = extracted
 
         # Completar con el perfil guardado cuando el LLM no detectó el dato
         if user_id:
@@ -214,16 +221,13 @@ def chat():
                 bn_result     = session_state.get("candidates", {})
                 genre_ranking = bn_result.get("genre_ranking", [])
                 current_genre = bn_result.get("ProgramGenre")
-                try:
-                    idx = genre_ranking.index(current_genre)
-                    if idx + 1 < len(genre_ranking):
-                        next_genre = genre_ranking[idx + 1]
-                        bn_result["ProgramGenre"] = next_genre
-                        session_state["candidates"] = bn_result
-                        if session_state.get("last_recommendation"):
-                            session_state["last_recommendation"]["ProgramGenre"] = next_genre
-                except (ValueError, IndexError):
-                    pass
+                idx = ranking_position(genre_ranking, current_genre)
+                if idx is not None and idx + 1 < len(genre_ranking):
+                    next_genre = genre_ranking[idx + 1]
+                    bn_result["ProgramGenre"] = next_genre
+                    session_state["candidates"] = bn_result
+                    if session_state.get("last_recommendation"):
+                        session_state["last_recommendation"]["ProgramGenre"] = next_genre
 
     elif intent == "FEEDBACK_POS":
         session_state["user_feedback"] = "accepted"
@@ -243,17 +247,27 @@ def chat():
     # SMALLTALK / OTHER → no hace nada con el estado
 
     # ── 3. Generar respuesta conversacional ──────────────────────
-    raw_response = converse(mensaje, session_state, conversation_history)
+    # Saludos/aceptaciones triviales → respuesta fija, sin llamar al LLM
+    response = templated_reply(mensaje, intent, session_state)
+    if response is None:
+        raw_response = converse(mensaje, session_state, conversation_history)
 
-    try:
-        response = json.loads(raw_response)
-    except json.JSONDecodeError:
-        print(f"[JSON error] {raw_response}")
-        return jsonify({"error": "Error interno al parsear respuesta"}), 500
+        try:
+            response = orjson.loads(raw_response)
+        except orjson.JSONDecodeError:
+            # Un reintento a temperatura 0 en modo JSON antes de devolver error
+            print(f"[JSON error, reintentando] {raw_response}")
+            raw_response = converse(mensaje, session_state, conversation_history, force_json=True)
+            try:
+                response = orjson.loads(raw_response)
+            except orjson.JSONDecodeError:
+                print(f"[JSON error] {raw_response}")
+                return jsonify({"error": "Error interno al parsear respuesta"}), 500
 
     # ── 4. Actualizar historial ──────────────────────────────────
     conversation_history.append({"role": "user",      "content": mensaje})
     conversation_history.append({"role": "assistant", "content": response.get("message", "")})
+    compact_history(conversation_history)
 
     # Guardar counts periódicamente
     _save_counts()
@@ -13,11 +13,17 @@ This module:
 
 """
 
+import hashlib
+import io
+import json
+import os
 import pickle
+import numpy as np
 import pandas as pd
 import networkx as nx
 import matplotlib.pyplot as plt
 
+from pgmpy.factors.discrete import TabularCPD
 from pgmpy.models import DiscreteBayesianNetwork
 from pgmpy.estimators import HillClimbSearch, BayesianEstimator, BDeu, ExpertKnowledge
 
@@ -77,13 +83,32 @@ for node in BASE_COLUMNS:
 # ============================================================================
 
 def load_data(path: str) -> pd.DataFrame:
-    return pd.read_csv(path)
+    # .pkl (written by dataset_gen) keeps the categorical columns and skips parsing
+    if path.endswith(".pkl"):
+        return pd.read_pickle(path)
+    # Categorical columns: scoring group-bys hash small int codes, not strings
+    try:
+        # Multithreaded Arrow parser when pyarrow is installed (optional)
+        return pd.read_csv(path, engine="pyarrow", dtype="category")
+    except ImportError:
+        print("pyarrow not available, reading CSV with the default engine")
+        return pd.read_csv(path, dtype="category")
 
 
 # ============================================================================
 # STRUCTURE LEARNING
 # ============================================================================
 
+def structure_hash(csv_path: str, equivalent_sample_size: int) -> str:
+    """Key for a learned structure: data file contents plus search settings"""
+    h = hashlib.blake2b(digest_size=8)
+    with open(csv_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    h.update(repr((BASE_COLUMNS, sorted(WHITELIST), sorted(BLACKLIST), equivalent_sample_size)).encode())
+    return h.hexdigest()
+
+
 def learn_structure(df: pd.DataFrame, equivalent_sample_size: int = 100):
     df_bn = df[BASE_COLUMNS].copy()
 
@@ -111,14 +136,36 @@ def build_and_fit_model(
     csv_path: str = "main/consumers_profile.csv",
     save_edges_path: str = "main/output/model_edges.csv",
     save_model_path: str = "main/output/model.pkl",
+    save_model_dir: str = "main/output/model",
     save_cpds_path: str = "main/output/model_cpds.txt",
     prior_type: str = "BDeu",
     equivalent_sample_size: int = 100,
     visualize: bool = False,
+    validate: bool = False,
+    structure_cache_dir: str = "main/output",
 ):
     df = load_data(csv_path)
 
-    edges, df_bn = learn_structure(df, equivalent_sample_size=equivalent_sample_size)
+    # Hill climbing dominates the build; reuse its result while the data and
+    # search settings are unchanged
+    cache_path = None
+    if structure_cache_dir:
+        cache_path = os.path.join(
+            structure_cache_dir,
+            f"structure_{structure_hash(csv_path, equivalent_sample_size)}.json",
+        )
+
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            edges = [tuple(edge) for edge in json.load(f)["edges"]]
+        df_bn = df[BASE_COLUMNS].copy()
+        print(f"Using cached structure: {cache_path}")
+    else:
+        edges, df_bn = learn_structure(df, equivalent_sample_size=equivalent_sample_size)
+        if cache_path:
+            os.makedirs(structure_cache_dir, exist_ok=True)
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump({"edges": edges}, f)
 
     model = DiscreteBayesianNetwork(edges)
 
@@ -129,7 +176,9 @@ def build_and_fit_model(
         equivalent_sample_size=equivalent_sample_size,
     )
 
-    model.check_model()
+    # BayesianEstimator already yields normalized CPDs; opt-in sanity check
+    if validate:
+        validate_cpds(model)
 
     if save_edges_path:
         save_edges(edges, save_edges_path)
@@ -137,6 +186,9 @@ def build_and_fit_model(
     if save_model_path:
         save_model(model, save_model_path)
 
+    if save_model_dir:
+        save_model_fast(model, save_model_dir)
+
     if save_cpds_path:
         save_cpds_to_text(model, save_cpds_path)
 
@@ -146,16 +198,42 @@ def build_and_fit_model(
     return model, df_bn, edges
 
 
+def validate_cpds(model: DiscreteBayesianNetwork) -> None:
+    """Check that every CPD column sums to 1 (one vectorized reduction per CPD)"""
+    for cpd in model.get_cpds():
+        if not np.allclose(cpd.get_values().sum(axis=0), 1.0, atol=0.01):
+            raise ValueError(f"CPD for {cpd.variable} is not normalized")
+
+
 # ============================================================================
 # VISUALIZATION
 # ============================================================================
 
-def visualize_model(model: DiscreteBayesianNetwork, figsize=(12, 9)) -> None:
+# spring_layout positions per edge set, reused across calls (notebooks)
+_layout_cache = {}
+
+
+# Matplotlib backends that cannot open a window
+NON_INTERACTIVE_BACKENDS = {"agg", "cairo", "pdf", "pgf", "ps", "svg", "template"}
+
+
+def visualize_model(model: DiscreteBayesianNetwork, figsize=(12, 9), save_to: str = None) -> None:
+    """
+    Draw the learned graph. With save_to the figure is written to that file
+    instead of shown; on a headless backend without save_to nothing is done.
+    """
+    if save_to is None and plt.get_backend().lower() in NON_INTERACTIVE_BACKENDS:
+        print("No display available; skipping graph visualization")
+        return
+
     graph = nx.DiGraph()
     graph.add_edges_from(model.edges())
 
     plt.figure(figsize=figsize)
-    pos = nx.spring_layout(graph, seed=42)
+    key = frozenset(graph.edges())
+    pos = _layout_cache.get(key)
+    if pos is None:
+        pos = _layout_cache[key] = nx.spring_layout(graph, seed=42)
 
     nx.draw(
         graph,
@@ -170,7 +248,11 @@ def visualize_model(model: DiscreteBayesianNetwork, figsize=(12, 9)) -> None:
 
     plt.title("Learned Bayesian Network (Base: Profile/Context → Content)")
     plt.tight_layout()
-    plt.show()
+    if save_to:
+        plt.savefig(save_to, dpi=100)
+        plt.close()
+    else:
+        plt.show()
 
 
 # ============================================================================
@@ -178,10 +260,9 @@ def visualize_model(model: DiscreteBayesianNetwork, figsize=(12, 9)) -> None:
 # ============================================================================
 
 def save_edges(edges, path: str) -> None:
+    body = "source,target\n" + "".join(f"{s},{t}\n" for s, t in edges)
     with open(path, "w", encoding="utf-8") as f:
-        f.write("source,target\n")
-        for s, t in edges:
-            f.write(f"{s},{t}\n")
+        f.write(body)
 
 
 def save_model(model: DiscreteBayesianNetwork, path: str) -> None:
@@ -190,18 +271,84 @@ def save_model(model: DiscreteBayesianNetwork, path: str) -> None:
 
 
 def load_model(path: str) -> DiscreteBayesianNetwork:
+    # A directory is the NumPy + JSON artifact written by save_model_fast
+    if os.path.isdir(path):
+        return load_model_fast(path)
     with open(path, "rb") as f:
         return pickle.load(f)
 
 
-def save_cpds_to_text(model: DiscreteBayesianNetwork, path: str) -> None:
+def save_model_fast(model: DiscreteBayesianNetwork, directory: str) -> None:
+    """
+    Save the model as structure.json (nodes, edges, parents, state names)
+    plus one cpds/<variable>.npy per CPD; no pickled pgmpy objects.
+    """
+    os.makedirs(os.path.join(directory, "cpds"), exist_ok=True)
+
+    structure = {
+        "nodes": list(model.nodes()),
+        "edges": [list(edge) for edge in model.edges()],
+        "cpds": {},
+    }
+    for cpd in model.get_cpds():
+        structure["cpds"][cpd.variable] = {
+            "evidence": list(cpd.variables[1:]),
+            "state_names": {var: list(states) for var, states in cpd.state_names.items()},
+        }
+        np.save(os.path.join(directory, "cpds", f"{cpd.variable}.npy"), cpd.get_values())
+
+    with open(os.path.join(directory, "structure.json"), "w", encoding="utf-8") as f:
+        json.dump(structure, f, indent=2)
+
+
+def load_model_fast(directory: str) -> DiscreteBayesianNetwork:
+    """Rebuild a model saved with save_model_fast (raw .npy tables, no unpickling)"""
+    with open(os.path.join(directory, "structure.json"), encoding="utf-8") as f:
+        structure = json.load(f)
+
+    model = DiscreteBayesianNetwork(structure["edges"])
+    model.add_nodes_from(structure["nodes"])
+
+    for variable, info in structure["cpds"].items():
+        state_names = info["state_names"]
+        values = np.load(os.path.join(directory, "cpds", f"{variable}.npy"))
+        model.add_cpds(TabularCPD(
+            variable=variable,
+            variable_card=len(state_names[variable]),
+            values=values,
+            evidence=info["evidence"] or None,
+            evidence_card=[len(state_names[p]) for p in info["evidence"]] or None,
+            state_names=state_names,
+        ))
+
+    return model
+
+
+def save_cpds_to_text(model: DiscreteBayesianNetwork, path: str, pretty: bool = False) -> None:
+    """
+    Dump every CPD to a text file. By default each table is written as CSV
+    rows (one per state, one column per parent configuration) under a JSON
+    header; pretty=True uses pgmpy's tabulated str(cpd) instead.
+    """
+    parts = ["Conditional Probability Tables (CPDs)\n", "=" * 80 + "\n\n"]
+    for cpd in model.get_cpds():
+        parts.append(f"CPD for {cpd.variable}:\n")
+        if pretty:
+            parts.append(str(cpd))
+        else:
+            header = {
+                "variable": cpd.variable,
+                "evidence": list(cpd.variables[1:]),
+                "state_names": {var: list(states) for var, states in cpd.state_names.items()},
+            }
+            parts.append(json.dumps(header) + "\n")
+            table = io.StringIO()
+            np.savetxt(table, cpd.get_values(), fmt="%.6g", delimiter=",")
+            parts.append(table.getvalue())
+        parts.append("\n" + "-" * 80 + "\n")
+
     with open(path, "w", encoding="utf-8") as f:
-        f.write("Conditional Probability Tables (CPDs)\n")
-        f.write("=" * 80 + "\n\n")
-        for cpd in model.get_cpds():
-            f.write(f"CPD for {cpd.variable}:\n")
-            f.write(str(cpd))
-            f.write("\n" + "-" * 80 + "\n")
+        f.write("".join(parts))
     print(f"CPDs saved to '{path}'")
 
 
@@ -1,37 +1,264 @@
+import string
 
+import numpy as np
 from pgmpy.inference import VariableElimination
 from pgmpy.models import DiscreteBayesianNetwork
 
 
-def recommend_gender(evidence, model):
-    infer = VariableElimination(model)
+# CPD revision per model; feedback bumps it so cached rankings are not reused
+_model_revisions = {}
+
+
+def model_revision(model):
+    return _model_revisions.get(id(model), 0)
+
+
+def bump_model_revision(model):
+    _model_revisions[id(model)] = model_revision(model) + 1
+
+
+# VariableElimination engine per (model, revision), rebuilt only after feedback
+_infer_cache = {}
+
+
+def get_inference(model):
+    key = (id(model), model_revision(model))
+    infer = _infer_cache.get(key)
+    if infer is None:
+        _infer_cache.clear()
+        infer = _infer_cache[key] = VariableElimination(model)
+    return infer
+
+
+class CompiledBN:
+    """
+    The BN's CPDs as NumPy tensors plus one einsum plan per query pattern.
+
+    Evidence is applied by slicing the CPD tensors; the remaining variables
+    are summed out by a single einsum whose contraction path is computed once
+    per (targets, evidence variables) and reused for any evidence values.
+    """
+
+    def __init__(self, model):
+        cpds = model.get_cpds()
+        self.state_names = {cpd.variable: list(cpd.state_names[cpd.variable]) for cpd in cpds}
+        self.state_index = {
+            var: {state: i for i, state in enumerate(states)}
+            for var, states in self.state_names.items()
+        }
+        self.symbols = dict(zip(self.state_names, string.ascii_letters))
+        self.factors = []
+        for cpd in cpds:
+            values = cpd.values
+            # Ejes de padres en el mismo orden de estados que su propia CPD
+            for axis, var in enumerate(cpd.variables):
+                order = [cpd.state_names[var].index(state) for state in self.state_names[var]]
+                values = np.take(values, order, axis=axis)
+            self.factors.append((list(cpd.variables), values))
+        self._factor_of = {variables[0]: i for i, (variables, _) in enumerate(self.factors)}
+        # Einsum plans depend only on the graph and cardinalities, not on the
+        # CPD values, so they can be carried over after feedback
+        self.signature = tuple((tuple(variables), values.shape) for variables, values in self.factors)
+        self._plans = {}
+
+    def lookup(self, variable, value, parent_values):
+        """P(variable=value | parents=parent_values) read straight from its CPD tensor"""
+        variables, values = self.factors[self._factor_of[variable]]
+        index = tuple(
+            self.state_index[v][value if v == variable else parent_values[v]]
+            for v in variables
+        )
+        return float(values[index])
+
+    def supports(self, targets, evidence):
+        return all(t in self.state_index and t not in evidence for t in targets) and all(
+            var in self.state_index and value in self.state_index[var]
+            for var, value in evidence.items()
+        )
+
+    def _plan(self, targets, evidence_vars, operands):
+        key = (targets, evidence_vars)
+        plan = self._plans.get(key)
+        if plan is None:
+            inputs = ",".join(
+                "".join(self.symbols[v] for v in variables if v not in evidence_vars)
+                for variables, _ in self.factors
+            )
+            subscripts = inputs + "->" + "".join(self.symbols[t] for t in targets)
+            path, _ = np.einsum_path(subscripts, *operands, optimize="greedy")
+            plan = self._plans[key] = (subscripts, path)
+        return plan
+
+    def precompile(self, targets, evidence_vars):
+        """Build the contraction plan for a query pattern ahead of the first query"""
+        evidence_vars = frozenset(evidence_vars)
+        operands = [
+            values[tuple(0 if v in evidence_vars else slice(None) for v in variables)]
+            for variables, values in self.factors
+        ]
+        self._plan(tuple(targets), evidence_vars, operands)
+
+    def query(self, targets, evidence):
+        """Normalized P(targets | evidence) as an array with one axis per target"""
+        operands = []
+        for variables, values in self.factors:
+            index = tuple(
+                self.state_index[v][evidence[v]] if v in evidence else slice(None)
+                for v in variables
+            )
+            operands.append(values[index])
+
+        subscripts, path = self._plan(tuple(targets), frozenset(evidence), operands)
+        dist = np.einsum(subscripts, *operands, optimize=path)
+        total = dist.sum()
+        return dist / total if total > 0 else None
+
+    def evidence_codes(self, targets, evidence_df):
+        """
+        {variable: int64 state indices} for a DataFrame of evidence rows,
+        or None if a column or value is unknown (or is one of the targets)
+        """
+        supported = len(evidence_df.columns) > 0 and all(
+            var in self.state_index and var not in targets
+            and set(evidence_df[var].unique()) <= self.state_index[var].keys()
+            for var in evidence_df
+        )
+        if not supported:
+            return None
+        return {
+            var: evidence_df[var].map(self.state_index[var]).to_numpy(dtype=np.int64)
+            for var in evidence_df
+        }
+
+    def query_batch(self, targets, evidence_codes):
+        """
+        P(targets | evidence) for B evidence rows over the same variables.
+
+        evidence_codes maps each evidence variable to an int array of state
+        indices (length B); the CPD tensors are gathered along a batch axis
+        and contracted in one einsum. Returns shape (B, *target cards).
+        """
+        batch = string.ascii_letters[len(self.symbols)]
+        operands, inputs = [], []
+        for variables, values in self.factors:
+            observed = [i for i, v in enumerate(variables) if v in evidence_codes]
+            free = "".join(self.symbols[v] for v in variables if v not in evidence_codes)
+            if observed:
+                values = np.moveaxis(values, observed, range(len(observed)))
+                values = values[tuple(evidence_codes[variables[i]] for i in observed)]
+                free = batch + free
+            operands.append(values)
+            inputs.append(free)
+
+        key = ("batch", tuple(targets), frozenset(evidence_codes))
+        plan = self._plans.get(key)
+        if plan is None:
+            subscripts = ",".join(inputs) + "->" + batch + "".join(self.symbols[t] for t in targets)
+            path, _ = np.einsum_path(subscripts, *operands, optimize="greedy")
+            plan = self._plans[key] = (subscripts, path)
+
+        subscripts, path = plan
+        dist = np.einsum(subscripts, *operands, optimize=path)
+        totals = dist.reshape(len(dist), -1).sum(axis=1)
+        return dist / totals.reshape((-1,) + (1,) * len(targets))
+
+
+# Compiled model per (model, revision), rebuilt only after feedback
+_compiled_cache = {}
+
+
+def get_compiled(model):
+    key = (id(model), model_revision(model))
+    compiled = _compiled_cache.get(key)
+    if compiled is None:
+        previous = next(iter(_compiled_cache.values()), None)
+        _compiled_cache.clear()
+        compiled = _compiled_cache[key] = CompiledBN(model)
+        if previous is not None and previous.signature == compiled.signature:
+            compiled._plans = previous._plans
+    return compiled
+
+
+# Evidence patterns of the RECOMMEND turn: time context is always known,
+# the profile attributes only when the user mentioned them
+RECOMMEND_TARGETS = ("ProgramType", "ProgramGenre")
+RECOMMEND_EVIDENCE = (
+    ("TimeOfDay", "DayType"),
+    ("UserAge", "UserGender", "HouseholdType", "TimeOfDay", "DayType"),
+)
+
+
+def precompile_recommendation(model, targets=RECOMMEND_TARGETS, evidence_sets=RECOMMEND_EVIDENCE):
+    """Compile the model and plan the usual recommendation queries at load time"""
+    compiled = get_compiled(model)
+    for evidence_vars in evidence_sets:
+        if all(var in compiled.state_index for var in (*targets, *evidence_vars)):
+            compiled.precompile(targets, evidence_vars)
+
+
+def _compiled_query(targets, evidence, model):
+    """Einsum query, or None when the pattern must go through pgmpy"""
+    compiled = get_compiled(model)
+    if not compiled.supports(targets, evidence):
+        return None
+    return compiled.query(targets, evidence)
+
+
+def _ranked(values, probs):
+    """(state, prob) pairs by descending probability; ties keep state order"""
+    order = np.argsort(-np.asarray(probs), kind="stable")
+    return [(values[i], probs[i]) for i in order]
+
+
+def _recommend(target, evidence, model):
+    """Ranked (state, prob) list for P(target | evidence)"""
+    probs = _compiled_query([target], evidence, model)
+    if probs is not None:
+        return _ranked(get_compiled(model).state_names[target], probs)
+
+    infer = get_inference(model)
     res = infer.query(
-        variables=["ProgramGenre"],
+        variables=[target],
         evidence=evidence,
         show_progress=False
     )
 
-    dist = res
-    values = dist.state_names["ProgramGenre"]
-    probs = dist.values
-
-    recommendations = list(zip(values, probs))
-    recommendations.sort(key=lambda x: x[1], reverse=True)
+    return _ranked(res.state_names[target], res.values)
 
-    return recommendations
+def recommend_gender(evidence, model):
+    return _recommend("ProgramGenre", evidence, model)
 
 def recommend_type(evidence, model):
-    infer = VariableElimination(model)
-    res = infer.query(
-        variables=["ProgramType"],
+    return _recommend("ProgramType", evidence, model)
+
+def recommend_type_and_genre(evidence, model):
+    """
+    One joint query P(ProgramType, ProgramGenre | evidence) instead of two:
+    types ranked by their marginal, genres conditioned on the top-ranked type
+    """
+    probs = _compiled_query(["ProgramType", "ProgramGenre"], evidence, model)
+    if probs is not None:
+        states = get_compiled(model).state_names
+        type_probs = probs.sum(axis=1)
+        type_recs = _ranked(states["ProgramType"], type_probs)
+
+        top = int(np.argmax(type_probs))
+        genre_recs = _ranked(states["ProgramGenre"], probs[top] / probs[top].sum())
+        return type_recs, genre_recs
+
+    infer = get_inference(model)
+    joint = infer.query(
+        variables=["ProgramType", "ProgramGenre"],
         evidence=evidence,
+        joint=True,
         show_progress=False
     )
 
-    values = res.state_names["ProgramType"]
-    probs = res.values
+    type_dist = joint.marginalize(["ProgramGenre"], inplace=False)
+    type_recs = _ranked(type_dist.state_names["ProgramType"], type_dist.values)
 
-    recommendations = list(zip(values, probs))
-    recommendations.sort(key=lambda x: x[1], reverse=True)
+    genre_dist = joint.reduce([("ProgramType", type_recs[0][0])], inplace=False)
+    genre_dist.normalize()
+    genre_recs = _ranked(genre_dist.state_names["ProgramGenre"], genre_dist.values)
 
-    return recommendations
+    return type_recs, genre_recs
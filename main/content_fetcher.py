@@ -3,12 +3,18 @@ Content Fetcher using TMDB API
 Retrieves real TV shows and movies based on BN recommendations
 """
 
+import atexit
 import os
+import time
 import requests
-from typing import List, Dict, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
 import logging
 
+from llm_cache import ResponseCache
+
 logger = logging.getLogger(__name__)
 
 
@@ -48,27 +54,63 @@ class TMDBContentFetcher:
         "entertainment": "tv"
     }
     
-    def __init__(self, api_key: Optional[str] = None):
+    # Cached responses older than this are fetched again
+    CACHE_TTL = 24 * 3600
+
+    # Seconds before a TMDB request is abandoned
+    REQUEST_TIMEOUT = 5
+
+    def __init__(self, api_key: Optional[str] = None, response_cache: Optional[ResponseCache] = None):
         """
         Initialize TMDB client
         
         Args:
             api_key: TMDB API key (if None, reads from environment variable TMDB_API_KEY)
+            response_cache: Cache for GET responses keyed by (endpoint, params).
+                Defaults to an in-memory LRU, persisted to TMDB_CACHE_PATH if set.
         """
         self.api_key = api_key or os.getenv("TMDB_API_KEY")
         if not self.api_key:
             raise ValueError("TMDB API key not provided. Set TMDB_API_KEY environment variable.")
         
         self.session = requests.Session()
-        self.session.params = {"api_key": self.api_key}
-    
+        # Fixed query params, merged per request instead of through Session.params
+        self._base_params = {"api_key": self.api_key}
+        # Pooled keep-alive connections, retrying rate limits and 5xx with backoff
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+        ))
+
+        if response_cache is None:
+            response_cache = ResponseCache(maxsize=1024, path=os.getenv("TMDB_CACHE_PATH"))
+            atexit.register(response_cache.close)
+        self.response_cache = response_cache
+
+    def _cache_key(self, endpoint: str, params: Dict) -> str:
+        return ResponseCache.make_key(endpoint, *(f"{k}={v}" for k, v in sorted(params.items())))
+
+    def _cached(self, key: str) -> Optional[Dict]:
+        entry = self.response_cache.get(key)
+        if entry is not None and time.time() - entry[0] < self.CACHE_TTL:
+            return entry[1]
+        return None
+
     def _get(self, endpoint: str, **params) -> Dict:
-        """Make GET request to TMDB API"""
+        """Make GET request to TMDB API (served from the response cache when fresh)"""
+        key = self._cache_key(endpoint, params)
+        data = self._cached(key)
+        if data is not None:
+            return data
+
         url = f"{self.BASE_URL}/{endpoint}"
-        response = self.session.get(url, params=params)
+        response = self.session.get(url, params={**self._base_params, **params}, timeout=self.REQUEST_TIMEOUT)
         response.raise_for_status()
-        return response.json()
-    
+        data = response.json()
+        self.response_cache.set(key, (time.time(), data))
+        return data
+
     def get_content_by_recommendation(
         self,
         program_type: str,
@@ -89,15 +131,7 @@ class TMDBContentFetcher:
             List of content items with title, overview, genre, etc.
         """
         
-        # Map to TMDB types
-        media_type = self.TYPE_MAPPING.get(program_type, "tv")
-        
-        # Get genre ID
-        genre_id = None
-        if program_genre in self.GENRE_MAPPING:
-            genre_id = self.GENRE_MAPPING[program_genre].get(media_type)
-        
-        logger.info(f"Fetching {media_type} content for genre: {program_genre} (ID: {genre_id})")
+        media_type, genre_id = self._resolve_recommendation(program_type, program_genre)
         
         # Discover content
         results = self._discover_content(
@@ -113,6 +147,19 @@ class TMDBContentFetcher:
             formatted.append(self._format_item(item, media_type))
         
         return formatted
+
+    def _resolve_recommendation(self, program_type: str, program_genre: str) -> Tuple[str, Optional[int]]:
+        """Map a BN (type, genre) pair to a TMDB media type and genre ID"""
+        # Map to TMDB types
+        media_type = self.TYPE_MAPPING.get(program_type, "tv")
+        
+        # Get genre ID
+        genre_id = None
+        if program_genre in self.GENRE_MAPPING:
+            genre_id = self.GENRE_MAPPING[program_genre].get(media_type)
+        
+        logger.info(f"Fetching {media_type} content for genre: {program_genre} (ID: {genre_id})")
+        return media_type, genre_id
     
     def _discover_content(
         self,
@@ -124,6 +171,25 @@ class TMDBContentFetcher:
         """
         Discover content using TMDB discover endpoint
         """
+        endpoint, params = self._discover_request(media_type, genre_id, language)
+        
+        try:
+            data = self._get(endpoint, **params)
+            results = data.get("results", [])[:limit]
+            return results
+        except Exception as e:
+            logger.error(f"Error fetching content: {e}")
+            return []
+
+    def _discover_request(
+        self,
+        media_type: str,
+        genre_id: Optional[int],
+        language: str
+    ) -> Tuple[str, Dict]:
+        """
+        Endpoint and query params for the TMDB discover endpoint
+        """
         endpoint = f"discover/{media_type}"
         
         params = {
@@ -142,38 +208,33 @@ class TMDBContentFetcher:
             ten_years_ago = (datetime.now() - timedelta(days=1700)).strftime("%Y-%m-%d")
             params["first_air_date.gte"] = ten_years_ago
         
-        try:
-            data = self._get(endpoint, **params)
-            results = data.get("results", [])[:limit]
-            return results
-        except Exception as e:
-            logger.error(f"Error fetching content: {e}")
-            return []
+        return endpoint, params
     
     def _format_item(self, item: Dict, media_type: str) -> Dict:
         """
         Format TMDB item to our internal structure
         """
+        get = item.get
         if media_type == "movie":
-            title = item.get("title", "")
-            date = item.get("release_date", "")
+            title = get("title", "")
+            date = get("release_date", "")
         else:
-            title = item.get("name", "")
-            date = item.get("first_air_date", "")
+            title = get("name", "")
+            date = get("first_air_date", "")
         
         return {
-            "id": item.get("id"),
+            "id": get("id"),
             "title": title,
-            "overview": item.get("overview", ""),
+            "overview": get("overview", ""),
             "type": media_type,
-            "genre_ids": item.get("genre_ids", []),
-            "popularity": item.get("popularity", 0),
-            "vote_average": item.get("vote_average", 0),
-            "vote_count": item.get("vote_count", 0),
+            "genre_ids": get("genre_ids", []),
+            "popularity": get("popularity", 0),
+            "vote_average": get("vote_average", 0),
+            "vote_count": get("vote_count", 0),
             "release_date": date,
-            "poster_path": item.get("poster_path"),
-            "backdrop_path": item.get("backdrop_path"),
-            "original_language": item.get("original_language", "")
+            "poster_path": get("poster_path"),
+            "backdrop_path": get("backdrop_path"),
+            "original_language": get("original_language", "")
         }
     
     def search_content(
@@ -297,23 +358,22 @@ def select_best_match(
     min_rating = preferences.get("min_rating", 6.0) if preferences else 6.0
     min_votes = preferences.get("min_votes", 50) if preferences else 50
     
-    # Filter by quality
-    filtered = [
-        c for c in candidates
-        if c.get("vote_average", 0) >= min_rating and c.get("vote_count", 0) >= min_votes
-    ]
-    
-    # If too restrictive, relax filters
-    if not filtered:
-        filtered = candidates
-    
-    # Sort by popularity and rating
-    filtered.sort(
-        key=lambda x: (x.get("popularity", 0) * 0.6 + x.get("vote_average", 0) * 0.4),
-        reverse=True
-    )
+    # Single pass: best score among the candidates passing the quality filter,
+    # or among all candidates if the filter is too restrictive
+    best = None
+    best_score = None
+    fallback = None
+    fallback_score = None
+    for c in candidates:
+        vote_average = c.get("vote_average", 0)
+        score = c.get("popularity", 0) * 0.6 + vote_average * 0.4
+        if fallback is None or score > fallback_score:
+            fallback, fallback_score = c, score
+        if vote_average >= min_rating and c.get("vote_count", 0) >= min_votes:
+            if best is None or score > best_score:
+                best, best_score = c, score
     
-    return filtered[0]
+    return best if best is not None else fallback
 
 
 # Example usage
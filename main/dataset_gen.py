@@ -5,166 +5,161 @@ import numpy as np
 # CONFIGURATION
 # -------------------------
 N = 10000
-np.random.seed(42)
+rng = np.random.default_rng(42)
+
+# Category tables: columns are stored as int8 codes into these lists
+AGES = ['young', 'adult', 'senior']
+GENDERS = ['male', 'female']
+HOUSEHOLDS = ['single', 'couple', 'family']
+TIMES = ['morning', 'afternoon', 'night']
+DAYS = ['weekday', 'weekend']
+TYPES = ['news', 'documentary', 'movie', 'series', 'entertainment']
+GENRES = ['news', 'documentary', 'comedy', 'drama', 'romance', 'horror', 'entertainment']
+DURATIONS = ['short', 'medium', 'long']
+
+
+def codes(categories, labels):
+    """Int8 codes of `labels` (a label or a list of labels) in `categories`"""
+    if isinstance(labels, str):
+        return np.int8(categories.index(labels))
+    return np.array([categories.index(label) for label in labels], dtype=np.int8)
+
+
+def sample(choices, size, p):
+    """
+    `size` draws from `choices` with probabilities `p`: one uniform batch
+    mapped through the cumulative distribution (inverse CDF)
+    """
+    cdf = np.cumsum(p)
+    cdf /= cdf[-1]
+    return choices[np.searchsorted(cdf, rng.random(size), side='right')]
+
+
+def draw_cases(out, categories, scope, cases):
+    """
+    Vectorized if/elif chain over the rows in `scope`.
+
+    Each case is (condition, choices, p): it takes the rows not claimed by a
+    previous case (condition None = else) and fills them with the codes of
+    one batched draw, or with the code of `choices` directly when p is None.
+    """
+    remaining = scope.copy()
+    for condition, choices, p in cases:
+        mask = remaining if condition is None else remaining & condition
+        choice_codes = codes(categories, choices)
+        out[mask] = choice_codes if p is None else sample(choice_codes, mask.sum(), p)
+        remaining &= ~mask
+
 
 # -------------------------
 # USER PROFILE
 # -------------------------
-user_age = np.random.choice(
-    ['young', 'adult', 'senior'], N, p=[0.4, 0.4, 0.2]
+user_age = sample(
+    codes(AGES, AGES), N, p=[0.4, 0.4, 0.2]
 )
 
-user_gender = np.random.choice(
-    ['male', 'female'], N, p=[0.5, 0.5]
+user_gender = sample(
+    codes(GENDERS, GENDERS), N, p=[0.5, 0.5]
 )
 
-household_type = np.random.choice(
-    ['single', 'couple', 'family'], N, p=[0.3, 0.4, 0.3]
+household_type = sample(
+    codes(HOUSEHOLDS, HOUSEHOLDS), N, p=[0.3, 0.4, 0.3]
 )
 
 # -------------------------
 # CONTEXT
 # -------------------------
-time_of_day = np.random.choice(
-    ['morning', 'afternoon', 'night'], N, p=[0.3, 0.4, 0.3]
+time_of_day = sample(
+    codes(TIMES, TIMES), N, p=[0.3, 0.4, 0.3]
 )
 
-day_type = np.random.choice(
-    ['weekday', 'weekend'], N, p=[0.7, 0.3]
+day_type = sample(
+    codes(DAYS, DAYS), N, p=[0.7, 0.3]
 )
 
 # -------------------------
 # CONTENT ATTRIBUTES
 # -------------------------
+senior = user_age == codes(AGES, 'senior')
+night = ~senior & (time_of_day == codes(TIMES, 'night'))
+daytime = ~senior & ~night
+weekend = day_type == codes(DAYS, 'weekend')
+family = household_type == codes(HOUSEHOLDS, 'family')
+female = user_gender == codes(GENDERS, 'female')
 
 # ProgramType depends on age, time of day, day type, gender, and household type
-program_type = []
-for age, time, gender, household, day in zip(
-    user_age, time_of_day, user_gender, household_type, day_type
-):
-    if age == 'senior':
-        if day == 'weekday':
-            pt = np.random.choice(
-                ['news', 'documentary', 'movie'], p=[0.6, 0.25, 0.15]
-            )
-        elif household == 'family':
-            pt = np.random.choice(
-                ['news', 'documentary', 'movie'], p=[0.55, 0.25, 0.2]
-            )
-        else:
-            pt = np.random.choice(
-                ['news', 'movie', 'documentary'], p=[0.5, 0.3, 0.2]
-            )
-    elif time == 'night':
-        if day == 'weekend':
-            pt = np.random.choice(
-                ['movie', 'series', 'entertainment'], p=[0.45, 0.35, 0.2]
-            )
-        elif household == 'family':
-            pt = np.random.choice(
-                ['series', 'entertainment', 'movie'], p=[0.45, 0.35, 0.2]
-            )
-        elif gender == 'female':
-            pt = np.random.choice(
-                ['series', 'movie', 'entertainment'], p=[0.45, 0.4, 0.15]
-            )
-        else:
-            pt = np.random.choice(
-                ['movie', 'series', 'entertainment'], p=[0.55, 0.3, 0.15]
-            )
-    else:
-        if day == 'weekend':
-            pt = np.random.choice(
-                ['entertainment', 'series', 'news'], p=[0.5, 0.35, 0.15]
-            )
-        elif household == 'family':
-            pt = np.random.choice(
-                ['entertainment', 'series', 'news'], p=[0.5, 0.35, 0.15]
-            )
-        elif gender == 'female':
-            pt = np.random.choice(
-                ['series', 'entertainment', 'news'], p=[0.4, 0.35, 0.25]
-            )
-        else:
-            pt = np.random.choice(
-                ['entertainment', 'news', 'series'], p=[0.4, 0.35, 0.25]
-            )
-    program_type.append(pt)
+program_type = np.empty(N, dtype=np.int8)
+draw_cases(program_type, TYPES, senior, [
+    (~weekend, ['news', 'documentary', 'movie'], [0.6, 0.25, 0.15]),
+    (family, ['news', 'documentary', 'movie'], [0.55, 0.25, 0.2]),
+    (None, ['news', 'movie', 'documentary'], [0.5, 0.3, 0.2]),
+])
+draw_cases(program_type, TYPES, night, [
+    (weekend, ['movie', 'series', 'entertainment'], [0.45, 0.35, 0.2]),
+    (family, ['series', 'entertainment', 'movie'], [0.45, 0.35, 0.2]),
+    (female, ['series', 'movie', 'entertainment'], [0.45, 0.4, 0.15]),
+    (None, ['movie', 'series', 'entertainment'], [0.55, 0.3, 0.15]),
+])
+draw_cases(program_type, TYPES, daytime, [
+    (weekend, ['entertainment', 'series', 'news'], [0.5, 0.35, 0.15]),
+    (family, ['entertainment', 'series', 'news'], [0.5, 0.35, 0.15]),
+    (female, ['series', 'entertainment', 'news'], [0.4, 0.35, 0.25]),
+    (None, ['entertainment', 'news', 'series'], [0.4, 0.35, 0.25]),
+])
 
 # ProgramGenre depends on ProgramType, day type, gender, and household type
-program_genre = []
-for pt, gender, household, day in zip(
-    program_type, user_gender, household_type, day_type
-):
-    if pt == 'news':
-        genre = 'news'
-    elif pt == 'documentary':
-        genre = 'documentary'
-    elif pt == 'movie':
-        if household == 'family':
-            genre = np.random.choice(
-                ['comedy', 'drama', 'romance', 'horror'], p=[0.4, 0.35, 0.2, 0.05]
-            )
-        elif gender == 'female':
-            genre = np.random.choice(
-                ['drama', 'romance', 'comedy', 'horror'], p=[0.45, 0.3, 0.2, 0.05]
-            )
-        else:
-            genre = np.random.choice(
-                ['drama', 'horror', 'comedy', 'romance'], p=[0.35, 0.25, 0.25, 0.15]
-            )
-    elif pt == 'series':
-        if household == 'family':
-            genre = np.random.choice(
-                ['comedy', 'drama', 'horror'], p=[0.5, 0.4, 0.1]
-            )
-        elif gender == 'female':
-            genre = np.random.choice(
-                ['drama', 'comedy', 'horror'], p=[0.45, 0.45, 0.1]
-            )
-        else:
-            genre = np.random.choice(
-                ['drama', 'comedy', 'horror'], p=[0.35, 0.4, 0.25]
-            )
-    else:  # entertainment
-        if day == 'weekend':
-            genre = np.random.choice(
-                ['entertainment', 'comedy'], p=[0.7, 0.3]
-            )
-        else:
-            genre = 'entertainment'
-    program_genre.append(genre)
+program_genre = np.empty(N, dtype=np.int8)
+draw_cases(program_genre, GENRES, program_type == codes(TYPES, 'news'), [(None, 'news', None)])
+draw_cases(program_genre, GENRES, program_type == codes(TYPES, 'documentary'), [(None, 'documentary', None)])
+draw_cases(program_genre, GENRES, program_type == codes(TYPES, 'movie'), [
+    (family, ['comedy', 'drama', 'romance', 'horror'], [0.4, 0.35, 0.2, 0.05]),
+    (female, ['drama', 'romance', 'comedy', 'horror'], [0.45, 0.3, 0.2, 0.05]),
+    (None, ['drama', 'horror', 'comedy', 'romance'], [0.35, 0.25, 0.25, 0.15]),
+])
+draw_cases(program_genre, GENRES, program_type == codes(TYPES, 'series'), [
+    (family, ['comedy', 'drama', 'horror'], [0.5, 0.4, 0.1]),
+    (female, ['drama', 'comedy', 'horror'], [0.45, 0.45, 0.1]),
+    (None, ['drama', 'comedy', 'horror'], [0.35, 0.4, 0.25]),
+])
+draw_cases(program_genre, GENRES, program_type == codes(TYPES, 'entertainment'), [
+    (weekend, ['entertainment', 'comedy'], [0.7, 0.3]),
+    (None, 'entertainment', None),
+])
 
 # ProgramDuration depends on ProgramType
-program_duration = []
-for pt in program_type:
-    if pt == 'movie':
-        duration = 'long'
-    elif pt == 'series':
-        duration = 'medium'
-    elif pt == 'news':
-        duration = 'short'
-    else:
-        duration = np.random.choice(
-            ['short', 'medium'], p=[0.6, 0.4]
-        )
-    program_duration.append(duration)
+# (fixed for movie/series/news, one batched draw for the rest)
+fixed_duration = [
+    (TYPES.index('movie'), 'long'),
+    (TYPES.index('series'), 'medium'),
+    (TYPES.index('news'), 'short'),
+]
+program_duration = np.select(
+    [program_type == t for t, _ in fixed_duration],
+    [codes(DURATIONS, d) for _, d in fixed_duration],
+    default=-1,
+).astype(np.int8)
+undecided = program_duration == -1
+program_duration[undecided] = sample(
+    codes(DURATIONS, ['short', 'medium']), size=undecided.sum(), p=[0.6, 0.4]
+)
 
 # -------------------------
 # FINAL DATASET
 # -------------------------
 df_profile = pd.DataFrame({
-    'UserAge': user_age,
-    'UserGender': user_gender,
-    'HouseholdType': household_type,
-    'TimeOfDay': time_of_day,
-    'DayType': day_type,
-    'ProgramType': program_type,
-    'ProgramGenre': program_genre,
-    'ProgramDuration': program_duration
+    'UserAge': pd.Categorical.from_codes(user_age, categories=AGES),
+    'UserGender': pd.Categorical.from_codes(user_gender, categories=GENDERS),
+    'HouseholdType': pd.Categorical.from_codes(household_type, categories=HOUSEHOLDS),
+    'TimeOfDay': pd.Categorical.from_codes(time_of_day, categories=TIMES),
+    'DayType': pd.Categorical.from_codes(day_type, categories=DAYS),
+    'ProgramType': pd.Categorical.from_codes(program_type, categories=TYPES),
+    'ProgramGenre': pd.Categorical.from_codes(program_genre, categories=GENRES),
+    'ProgramDuration': pd.Categorical.from_codes(program_duration, categories=DURATIONS)
 })
 
 df_profile.to_csv("main/consumers_profile.csv", index=False)
+# Binary copy with the categorical dtypes, loaded without CSV parsing
+df_profile.to_pickle("main/consumers_profile.pkl")
 
 print("✅ ConsumersProfile dataset generated successfully")
 print(df_profile.head())
@@ -1,9 +1,19 @@
 # feedback.py
 
-from collections import defaultdict
+import ast
 import itertools
+import logging
+import numpy as np
+import orjson
 from pgmpy.factors.discrete import TabularCPD
 
+from bn_recommender import bump_model_revision
+
+logger = logging.getLogger(__name__)
+
+# Pseudo-counts don't need double precision; CPDs are rebuilt in float64
+COUNTS_DTYPE = np.float32
+
 
 # ============================================================================
 # Initialize counts from existing CPDs
@@ -13,32 +23,17 @@ def initialize_cpt_counts(model, virtual_sample_size=100):
     """
     Convert model CPDs into initial in-memory counts
     using a virtual sample size for smoothing.
+
+    Counts are a dense array shaped like cpd.values:
+    (variable states, parent 1 states, parent 2 states, ...)
     """
     cpt_counts = {}
 
     for cpd in model.get_cpds():
-        variable = cpd.variable
-        parents = cpd.variables[1:]
-        state_names = cpd.state_names
-
-        counts = defaultdict(lambda: defaultdict(float))
-        values = cpd.values
-
-        for idx, state in enumerate(state_names[variable]):
-            for parent_idx in itertools.product(
-                *[range(len(state_names[p])) for p in parents]
-            ):
-                parent_state = tuple(
-                    state_names[p][parent_idx[i]]
-                    for i, p in enumerate(parents)
-                )
-                prob = values[(idx,) + parent_idx]
-                counts[parent_state][state] = prob * virtual_sample_size
-
-        cpt_counts[variable] = {
-            "parents": parents,
-            "state_names": state_names,
-            "counts": counts
+        cpt_counts[cpd.variable] = {
+            "parents": list(cpd.variables[1:]),
+            "state_names": cpd.state_names,
+            "counts": np.ascontiguousarray(cpd.values, dtype=COUNTS_DTYPE) * COUNTS_DTYPE(virtual_sample_size)
         }
 
     return cpt_counts
@@ -48,9 +43,25 @@ def initialize_cpt_counts(model, virtual_sample_size=100):
 # Build CPD safely from counts
 # ============================================================================
 
-def build_cpd_from_counts(variable, cpt_info):
+def normalize_columns(counts_table, columns=None):
+    """
+    Probabilities for the given columns of a (states, parent combinations)
+    counts table (all columns if None); all-zero columns map to 0.
+    """
+    if columns is not None:
+        counts_table = counts_table[:, columns]
+    counts_table = counts_table.astype(np.float64)
+    totals = counts_table.sum(axis=0, keepdims=True)
+    return np.divide(counts_table, totals, out=np.zeros_like(counts_table), where=totals > 0)
+
+
+def build_cpd_from_counts(variable, cpt_info, columns=None):
     """
     Rebuild a TabularCPD from the counts dictionary.
+
+    The normalized table is kept in cpt_info["_probs"]; when `columns` is
+    given (parent combinations changed since the last build) only those
+    columns are renormalized.
     """
     parents = cpt_info["parents"]
     state_names = cpt_info["state_names"]
@@ -58,28 +69,58 @@ def build_cpd_from_counts(variable, cpt_info):
 
     var_states = state_names[variable]
     parent_states = [state_names[p] for p in parents]
-    parent_combinations = list(itertools.product(*parent_states))
 
-    values = []
-
-    for v in var_states:
-        row = []
-        for parent_state in parent_combinations:
-            total = sum(counts[parent_state].values())
-            prob = counts[parent_state][v] / total if total > 0 else 0.0
-            row.append(prob)
-        values.append(row)
+    table = counts.reshape(len(var_states), -1)
+    probs = cpt_info.get("_probs")
+    if probs is None or columns is None:
+        probs = cpt_info["_probs"] = normalize_columns(table)
+    else:
+        probs[:, columns] = normalize_columns(table, columns)
 
     return TabularCPD(
         variable=variable,
         variable_card=len(var_states),
-        values=values,
+        values=probs,
         evidence=parents,
         evidence_card=[len(ps) for ps in parent_states],
         state_names=state_names
     )
 
 
+def refresh_model_cpd(model, variable, cpt_info, columns=None):
+    """
+    Push the counts of `variable` into the model's CPD.
+
+    When the model's CPD has the same parents and state order as the counts
+    and was already built from them (cpt_info["_probs"] exists), only the
+    changed columns are written into its values in place (no
+    remove_cpds/add_cpds); otherwise the whole CPD is rebuilt from the
+    counts and replaced, so freshly loaded counts are never partially applied.
+    """
+    existing = model.get_cpds(variable)
+    in_place = (
+        existing
+        and columns is not None
+        and cpt_info.get("_probs") is not None
+        and list(existing.variables) == [variable] + list(cpt_info["parents"])
+        and existing.state_names == cpt_info["state_names"]
+        and existing.values.flags.c_contiguous
+    )
+
+    if in_place:
+        table = cpt_info["counts"].reshape(existing.values.shape[0], -1)
+        probs = normalize_columns(table, columns)
+        existing.values.reshape(table.shape)[:, columns] = probs
+        cpt_info["_probs"][:, columns] = probs
+    else:
+        new_cpd = build_cpd_from_counts(variable, cpt_info, columns)
+        if existing:
+            model.remove_cpds(existing)
+        model.add_cpds(new_cpd)
+
+    bump_model_revision(model)
+
+
 # ============================================================================
 # Apply feedback (ProgramType, ProgramGenre)
 # ============================================================================
@@ -99,24 +140,12 @@ def apply_feedback(model, cpt_counts, state, learning_rate=500):
         - If rejected: penalize the recommended pair, boost alternatives
     """
     
-    feedback = state.get("user_feedback")
-    if feedback not in ("accepted", "rejected"):
-        return
-    
-    last_rec = state.get("last_recommendation")
-    if not last_rec:
+    event = feedback_event(state)
+    if event is None:
         return
+    feedback, program_type, program_genre, attrs = event
     
-    program_type = last_rec.get("ProgramType")
-    program_genre = last_rec.get("ProgramGenre")
-    
-    if not program_type or not program_genre:
-        return
-    
-    # Get contextual attributes for conditioning
-    attrs = state.get("atributes_bn", {})
-    
-    print(f"\n Applying feedback: {feedback} for Type={program_type}, Genre={program_genre}")
+    logger.debug("Applying feedback: %s for Type=%s, Genre=%s", feedback, program_type, program_genre)
     
     # ========================================
     # 1. Update ProgramType CPD
@@ -135,46 +164,91 @@ def apply_feedback(model, cpt_counts, state, learning_rate=500):
         )
 
 
-def update_program_type_cpd(model, cpt_counts, program_type, attrs, feedback, learning_rate):
+def feedback_event(state):
     """
-    Update ProgramType CPD based on feedback.
+    (feedback, program_type, program_genre, attrs) from a state,
+    or None if it carries no usable feedback.
     """
-    cpt = cpt_counts["ProgramType"]
-    parents = cpt["parents"]
+    feedback = state.get("user_feedback")
+    if feedback not in ("accepted", "rejected"):
+        return None
+    
+    last_rec = state.get("last_recommendation")
+    if not last_rec:
+        return None
+    
+    program_type = last_rec.get("ProgramType")
+    program_genre = last_rec.get("ProgramGenre")
+    
+    if not program_type or not program_genre:
+        return None
+    
+    # Get contextual attributes for conditioning
+    attrs = state.get("atributes_bn", {})
+    return feedback, program_type, program_genre, attrs
 
-    matching = get_matching_parent_states(parents, attrs, cpt["state_names"])
-    updated = False
 
-    for parent_state, weight in matching:
-        if parent_state not in cpt["counts"]:
+def apply_feedback_batch(model, cpt_counts, states, learning_rate=500):
+    """
+    Apply the feedback of many states, updating counts per event but
+    refreshing each touched CPD only once at the end. A state may carry its
+    own "learning_rate", which overrides the shared default.
+
+    Returns:
+        Number of states that carried feedback
+    """
+    dirty = {}
+    applied = 0
+    for state in states:
+        event = feedback_event(state)
+        if event is None:
             continue
+        feedback, program_type, program_genre, attrs = event
+        lr = state.get("learning_rate", learning_rate)
+        applied += 1
 
-        effective_lr = learning_rate * weight
-        updated = True
+        if "ProgramType" in cpt_counts:
+            columns = update_program_type_counts(cpt_counts, program_type, attrs, feedback, lr)
+            if columns is not None:
+                dirty.setdefault("ProgramType", []).append(columns)
 
-        if feedback == "accepted":
-            cpt["counts"][parent_state][program_type] += effective_lr
+        if "ProgramGenre" in cpt_counts:
+            columns = update_program_genre_counts(cpt_counts, program_type, program_genre, attrs, feedback, lr)
+            if columns is not None:
+                dirty.setdefault("ProgramGenre", []).append(columns)
 
-        elif feedback == "rejected":
-            current = cpt["counts"][parent_state][program_type]
-            penalty = min(effective_lr * 0.5, current * 0.2)
-            cpt["counts"][parent_state][program_type] = max(1, current - penalty)
+    for variable, column_lists in dirty.items():
+        refresh_model_cpd(model, variable, cpt_counts[variable], np.unique(np.concatenate(column_lists)))
 
-            all_types = cpt["state_names"]["ProgramType"]
-            alternatives = [t for t in all_types if t != program_type]
-            boost_per_alt = penalty / len(alternatives) if alternatives else 0
-            for alt in alternatives:
-                cpt["counts"][parent_state][alt] += boost_per_alt
+    return applied
 
-    if not updated:
-        print(f"[feedback] No matching parent states found for ProgramType with attrs={attrs}")
-        return
 
-    new_cpd = build_cpd_from_counts("ProgramType", cpt)
-    existing = model.get_cpds("ProgramType")
-    if existing:
-        model.remove_cpds(existing)
-    model.add_cpds(new_cpd)
+def update_program_type_cpd(model, cpt_counts, program_type, attrs, feedback, learning_rate):
+    """
+    Update ProgramType CPD based on feedback.
+    """
+    columns = update_program_type_counts(cpt_counts, program_type, attrs, feedback, learning_rate)
+    if columns is not None:
+        refresh_model_cpd(model, "ProgramType", cpt_counts["ProgramType"], columns)
+
+
+def update_program_type_counts(cpt_counts, program_type, attrs, feedback, learning_rate):
+    """
+    Update ProgramType counts; returns the touched columns (None if none).
+    """
+    cpt = cpt_counts["ProgramType"]
+
+    matching = cached_matching_parent_states(cpt, attrs)
+
+    if program_type not in cpt["state_names"]["ProgramType"]:
+        logger.warning("Unknown ProgramType '%s'", program_type)
+        return None
+
+    columns = bump_counts(cpt, "ProgramType", program_type, matching, feedback, learning_rate)
+
+    if columns is None:
+        logger.warning("No matching parent states found for ProgramType with attrs=%s", attrs)
+    return columns
 
 
 def update_program_genre_cpd(model, cpt_counts, program_type, program_genre, attrs, feedback, learning_rate):
@@ -182,46 +256,120 @@ def update_program_genre_cpd(model, cpt_counts, program_type, program_genre, att
     Update ProgramGenre CPD based on feedback.
     ProgramGenre typically depends on ProgramType and possibly other context.
     """
+    columns = update_program_genre_counts(cpt_counts, program_type, program_genre, attrs, feedback, learning_rate)
+    if columns is not None:
+        refresh_model_cpd(model, "ProgramGenre", cpt_counts["ProgramGenre"], columns)
+
+
+def update_program_genre_counts(cpt_counts, program_type, program_genre, attrs, feedback, learning_rate):
+    """
+    Update ProgramGenre counts; returns the touched columns (None if none).
+    """
     cpt = cpt_counts["ProgramGenre"]
-    parents = cpt["parents"]
 
     # ProgramType is always known here
     attrs_with_type = dict(attrs)
     attrs_with_type["ProgramType"] = program_type
 
-    matching = get_matching_parent_states(parents, attrs_with_type, cpt["state_names"])
-    updated = False
+    matching = cached_matching_parent_states(cpt, attrs_with_type)
+
+    if program_genre not in cpt["state_names"]["ProgramGenre"]:
+        logger.warning("Unknown ProgramGenre '%s'", program_genre)
+        return None
+
+    columns = bump_counts(cpt, "ProgramGenre", program_genre, matching, feedback, learning_rate)
+
+    if columns is None:
+        logger.warning("No matching parent states found for ProgramGenre with attrs=%s", attrs_with_type)
+    return columns
+
+
+def bump_counts(cpt, variable, value, matching, feedback, learning_rate):
+    """
+    Apply one feedback event to all matching parent states at once.
+
+    The counts array is viewed as a (states, parent combinations) table and
+    the matched columns are updated with vectorized indexing.
+
+    Returns:
+        Flat indices of the updated parent combinations,
+        or None if none of the parent states exist in the counts
+    """
+    parents = cpt["parents"]
+    state_names = cpt["state_names"]
 
+    rows, weights = [], []
     for parent_state, weight in matching:
-        if parent_state not in cpt["counts"]:
-            continue
+        parent_idx = get_parent_index(parents, parent_state, state_names)
+        if parent_idx is not None:
+            rows.append(parent_idx)
+            weights.append(weight)
+    if not rows:
+        return None
 
-        effective_lr = learning_rate * weight
-        updated = True
+    counts = cpt["counts"]
+    table = counts.reshape(counts.shape[0], -1)
+    if parents:
+        columns = np.ravel_multi_index(tuple(np.array(rows).T), counts.shape[1:])
+    else:
+        columns = np.zeros(len(rows), dtype=np.intp)
 
-        if feedback == "accepted":
-            cpt["counts"][parent_state][program_genre] += effective_lr
+    target = state_names[variable].index(value)
+    effective_lr = learning_rate * np.array(weights)
 
-        elif feedback == "rejected":
-            current = cpt["counts"][parent_state][program_genre]
-            penalty = min(effective_lr * 0.5, current * 0.2)
-            cpt["counts"][parent_state][program_genre] = max(1, current - penalty)
+    FEEDBACK_UPDATES[feedback](table, target, columns, effective_lr)
+    return columns
 
-            all_genres = cpt["state_names"]["ProgramGenre"]
-            alternatives = [g for g in all_genres if g != program_genre]
-            boost_per_alt = penalty / len(alternatives) if alternatives else 0
-            for alt in alternatives:
-                cpt["counts"][parent_state][alt] += boost_per_alt
 
-    if not updated:
-        print(f"[feedback] No matching parent states found for ProgramGenre with attrs={attrs_with_type}")
-        return
+def _accept_counts(table, target, columns, effective_lr):
+    """Reinforce the recommended state"""
+    table[target, columns] += effective_lr
+
+
+def _reject_counts(table, target, columns, effective_lr):
+    """Penalize the recommended state and spread the penalty over the rest"""
+    current = table[target, columns]
+    penalty = np.minimum(effective_lr * 0.5, current * 0.2)
+    table[target, columns] = np.maximum(1, current - penalty)
+
+    alternatives = [i for i in range(table.shape[0]) if i != target]
+    if alternatives:
+        table[np.ix_(alternatives, columns)] += penalty / len(alternatives)
+
+
+FEEDBACK_UPDATES = {
+    "accepted": _accept_counts,
+    "rejected": _reject_counts,
+}
+
+
+def get_parent_index(parents, parent_state, state_names):
+    """
+    Index tuple of a parent state combination into the counts array,
+    or None if any value is not a known state of its parent.
+    """
+    try:
+        return tuple(state_names[p].index(v) for p, v in zip(parents, parent_state))
+    except ValueError:
+        return None
+
+
+def cached_matching_parent_states(cpt_info, attrs):
+    """
+    get_matching_parent_states memoized per CPT on the parents' values,
+    so events from the same context reuse the expanded combinations.
+    """
+    parents = cpt_info["parents"]
+    key = tuple(attrs.get(p) for p in parents)
+    cache = cpt_info.setdefault("_matching", {})
+    matching = cache.get(key)
+    if matching is None:
+        matching = cache[key] = get_matching_parent_states(parents, attrs, cpt_info["state_names"])
+    return matching
 
-    new_cpd = build_cpd_from_counts("ProgramGenre", cpt)
-    existing = model.get_cpds("ProgramGenre")
-    if existing:
-        model.remove_cpds(existing)
-    model.add_cpds(new_cpd)
+
+# Attribute values that mean "unknown parent"
+UNKNOWN_VALUES = frozenset({None, "", "null"})
 
 
 def get_matching_parent_states(parents, attrs, state_names):
@@ -230,13 +378,11 @@ def get_matching_parent_states(parents, attrs, state_names):
     that match the known attributes. Unknown parents expand to all their
     possible states with equal weight (fractional update).
     """
-    parent_options = []
-    for p in parents:
-        value = attrs.get(p)
-        if value not in (None, "", "null"):
-            parent_options.append([value])
-        else:
-            parent_options.append(state_names[p])
+    get = attrs.get
+    parent_options = [
+        state_names[p] if get(p) in UNKNOWN_VALUES else [get(p)]
+        for p in parents
+    ]
 
     combinations = list(itertools.product(*parent_options))
     weight = 1.0 / len(combinations)
@@ -251,45 +397,52 @@ def save_cpt_counts(cpt_counts, filepath):
     """
     Save CPT counts to a JSON file for persistence across sessions.
     """
-    import json
-    
-    # Convert defaultdict to regular dict for JSON serialization
+    # Counts arrays are serialized natively by orjson as nested lists
     serializable = {}
     for var, info in cpt_counts.items():
-        counts_dict = {
-            str(k): dict(v) for k, v in info["counts"].items()
-        }
         serializable[var] = {
             "parents": info["parents"],
             "state_names": info["state_names"],
-            "counts": counts_dict
+            "counts": info["counts"]
         }
     
-    with open(filepath, 'w') as f:
-        json.dump(serializable, f, indent=2)
+    with open(filepath, 'wb') as f:
+        f.write(orjson.dumps(serializable, option=orjson.OPT_SERIALIZE_NUMPY))
     
-    print(f"CPT counts saved to {filepath}")
+    logger.debug("CPT counts saved to %s", filepath)
 
 
 def load_cpt_counts(filepath):
     """
     Load CPT counts from a JSON file.
+
+    Also reads the older format where counts were a dict of
+    "('parent', 'states')" -> {state: count}.
     """
-    import json
-    
-    with open(filepath, 'r') as f:
-        data = json.load(f)
+    with open(filepath, 'rb') as f:
+        data = orjson.loads(f.read())
     
     cpt_counts = {}
     for var, info in data.items():
-        counts = defaultdict(lambda: defaultdict(float))
-        for k_str, v_dict in info["counts"].items():
-            k_tuple = eval(k_str) 
-            counts[k_tuple] = defaultdict(float, v_dict)
+        parents = info["parents"]
+        state_names = info["state_names"]
+
+        if isinstance(info["counts"], list):
+            counts = np.array(info["counts"], dtype=COUNTS_DTYPE)
+        else:
+            shape = [len(state_names[var])] + [len(state_names[p]) for p in parents]
+            counts = np.zeros(shape, dtype=COUNTS_DTYPE)
+            for k_str, v_dict in info["counts"].items():
+                k_tuple = ast.literal_eval(k_str)
+                parent_idx = get_parent_index(parents, k_tuple, state_names)
+                if parent_idx is None:
+                    continue
+                for state, count in v_dict.items():
+                    counts[(state_names[var].index(state),) + parent_idx] = count
         
         cpt_counts[var] = {
-            "parents": info["parents"],
-            "state_names": info["state_names"],
+            "parents": parents,
+            "state_names": state_names,
             "counts": counts
         }
     
@@ -6,9 +6,10 @@ This module uses the DiscreteBayesianNetwork model generated by
 """
 
 import pickle
-from pgmpy.inference import VariableElimination
 from pgmpy.models import DiscreteBayesianNetwork
 
+from bn_recommender import get_inference
+
 
 CORE_NODES = [
     "UserAge",
@@ -34,8 +35,8 @@ def run_query(model, variables, evidence=None):
     evidence: dict mapping variable->value.
     Returns the VariableElimination.query result (pgmpy object).
     """
-    infer = VariableElimination(model)
-    result = infer.query(variables=variables, evidence=evidence or {})
+    infer = get_inference(model)
+    result = infer.query(variables=variables, evidence=evidence or {}, show_progress=False)
     return result
 
 
@@ -0,0 +1,101 @@
+"""
+llm_cache.py
+
+Exact-match cache for deterministic (temperature=0) LLM calls.
+
+Keys are a hash of everything that determines the answer (system prompt,
+user message, ...), so editing a prompt automatically invalidates its entries.
+Values are the already-parsed results (intent string, attribute dict, ...).
+
+- In-process LRU (OrderedDict) for hot lookups
+- Optional on-disk store (shelve) persisted across runs
+- Safe to share between threads (one lock around memory and disk access)
+"""
+
+import copy
+import hashlib
+import shelve
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    LRU cache of parsed LLM responses with an optional shelve backing store
+    """
+
+    def __init__(self, maxsize: int = 4096, path: str = None):
+        """
+        Args:
+            maxsize: Maximum number of entries kept in memory
+            path: Shelve file for persistence across runs (None = memory only)
+        """
+        self.maxsize = maxsize
+        self.path = path
+        self._memory = OrderedDict()
+        self._disk = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """Hash the parts that determine a response into a cache key"""
+        h = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _open_disk(self):
+        if self._disk is None and self.path:
+            self._disk = shelve.open(self.path)
+        return self._disk
+
+    def get(self, key: str):
+        """Return a copy of the cached value, or None on miss"""
+        with self._lock:
+            value = self._lookup(key)
+        return None if value is None else copy.deepcopy(value)
+
+    def _lookup(self, key: str):
+        if key in self._memory:
+            self.hits += 1
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        disk = self._open_disk()
+        if disk is not None and key in disk:
+            self.hits += 1
+            value = disk[key]
+            self._remember(key, value)
+            return value
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value) -> None:
+        """Store a parsed response in memory (and on disk if enabled)"""
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._remember(key, value)
+
+            disk = self._open_disk()
+            if disk is not None:
+                disk[key] = value
+
+    def _remember(self, key: str, value) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Hit/miss counters, like functools' cache_info()"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._memory), "maxsize": self.maxsize}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
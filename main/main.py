@@ -1,25 +1,67 @@
-import json
+import asyncio
+import logging
+import os
+import sys
 from pathlib import Path
 
-from feedback import initialize_cpt_counts, apply_feedback, load_cpt_counts, save_cpt_counts
+import orjson
+
+from feedback import initialize_cpt_counts, apply_feedback, load_cpt_counts, refresh_model_cpd, save_cpt_counts
 from main.bn_builder import load_model
+from bn_recommender import precompile_recommendation
 from LLM_agent import (
     ACTION_COLORS,
+    BN_LOG_COLOR,
+    COLOR_ENABLED,
+    COLOR_RESET,
     INTENT_COLORS,
-    classify_intent,
+    aclassify_and_extract,
+    aclose_clients,
+    acompact_history,
+    aconverse,
+    aconverse_stream,
+    bn_cache,
     colorize,
-    converse,
-    extract_attributes_llm,
     get_time_daytype,
     infer_with_bn,
+    response_cache,
+    templated_reply,
 )
 from content_fetcher import TMDBContentFetcher
+from smart_alternative import ranking_position
+from state_log import StateLogWriter
 
 # Nuevos colores para content
 CONTENT_COLOR = "\033[96m"
 WARNING_COLOR = "\033[93m"
 
 
+class ColorFormatter(logging.Formatter):
+    """Colors log records by their "style" extra, like the colorize() prints"""
+
+    STYLE_COLORS = {"warning": WARNING_COLOR, "content": CONTENT_COLOR}
+
+    def format(self, record):
+        return colorize(super().format(record), self.STYLE_COLORS.get(getattr(record, "style", None), ""))
+
+
+def setup_logging() -> None:
+    """Show genre-switch progress in the terminal (LOG_LEVEL=WARNING hides it)"""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(ColorFormatter("%(message)s"))
+    alt_logger = logging.getLogger("smart_alternative")
+    alt_logger.addHandler(handler)
+    alt_logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    alt_logger.propagate = False
+
+
+# (prefix, suffix) around the per-turn intent line
+INTENT_LINE = {
+    intent: (color, COLOR_RESET) if COLOR_ENABLED else ("", "")
+    for intent, color in INTENT_COLORS.items()
+}
+
+
 def fetch_real_content(
     bn_result: dict, 
     content_fetcher: TMDBContentFetcher, 
@@ -123,99 +165,93 @@ def try_next_alternative(state: dict, content_fetcher: TMDBContentFetcher) -> bo
     current_genre = bn_result.get("ProgramGenre")
     
     # Find next genre in ranking
-    try:
-        current_idx = genre_ranking.index(current_genre)
-        if current_idx + 1 < len(genre_ranking):
-            next_genre = genre_ranking[current_idx + 1]
-            print(colorize(f"   Trying next genre: {next_genre}", WARNING_COLOR))
-            
-            # Update BN result
-            bn_result["ProgramGenre"] = next_genre
+    current_idx = ranking_position(genre_ranking, current_genre)
+    if current_idx is not None and current_idx + 1 < len(genre_ranking):
+        next_genre = genre_ranking[current_idx + 1]
+        print(colorize(f"   Trying next genre: {next_genre}", WARNING_COLOR))
+        
+        # Update BN result
+        bn_result["ProgramGenre"] = next_genre
+        
+        # Fetch new content
+        new_content = fetch_real_content(bn_result, content_fetcher, limit=10, fallback_to_alternatives=False)
+        
+        if new_content:
+            state["real_content"] = new_content
+            state["content_index"] = 0
+            state["candidates"] = bn_result
             
-            # Fetch new content
-            new_content = fetch_real_content(bn_result, content_fetcher, limit=10, fallback_to_alternatives=False)
+            if state.get("last_recommendation"):
+                state["last_recommendation"]["ProgramGenre"] = next_genre
+                state["last_recommendation"]["content"] = new_content[0]
             
-            if new_content:
-                state["real_content"] = new_content
-                state["content_index"] = 0
-                state["candidates"] = bn_result
-                
-                if state.get("last_recommendation"):
-                    state["last_recommendation"]["ProgramGenre"] = next_genre
-                    state["last_recommendation"]["content"] = new_content[0]
-                
-                return True
-    except (ValueError, IndexError):
-        pass
-    
+            return True
+
     # Try different type as last resort
     print(colorize("Trying different program type...", WARNING_COLOR))
     type_ranking = bn_result.get("type_ranking", [])
     current_type = bn_result.get("ProgramType")
     
-    try:
-        current_idx = type_ranking.index(current_type)
-        if current_idx + 1 < len(type_ranking):
-            next_type = type_ranking[current_idx + 1]
-            print(colorize(f"   Trying type: {next_type}", WARNING_COLOR))
-            
-            # Reset to first genre for new type
-            bn_result["ProgramType"] = next_type
-            bn_result["ProgramGenre"] = genre_ranking[0] if genre_ranking else current_genre
+    current_idx = ranking_position(type_ranking, current_type)
+    if current_idx is not None and current_idx + 1 < len(type_ranking):
+        next_type = type_ranking[current_idx + 1]
+        print(colorize(f"   Trying type: {next_type}", WARNING_COLOR))
+        
+        # Reset to first genre for new type
+        bn_result["ProgramType"] = next_type
+        bn_result["ProgramGenre"] = genre_ranking[0] if genre_ranking else current_genre
+        
+        new_content = fetch_real_content(bn_result, content_fetcher, limit=10, fallback_to_alternatives=True)
+        
+        if new_content:
+            state["real_content"] = new_content
+            state["content_index"] = 0
+            state["candidates"] = bn_result
             
-            new_content = fetch_real_content(bn_result, content_fetcher, limit=10, fallback_to_alternatives=True)
+            if state.get("last_recommendation"):
+                state["last_recommendation"]["ProgramType"] = next_type
+                state["last_recommendation"]["ProgramGenre"] = bn_result["ProgramGenre"]
+                state["last_recommendation"]["content"] = new_content[0]
             
-            if new_content:
-                state["real_content"] = new_content
-                state["content_index"] = 0
-                state["candidates"] = bn_result
-                
-                if state.get("last_recommendation"):
-                    state["last_recommendation"]["ProgramType"] = next_type
-                    state["last_recommendation"]["ProgramGenre"] = bn_result["ProgramGenre"]
-                    state["last_recommendation"]["content"] = new_content[0]
-                
-                return True
-    except (ValueError, IndexError):
-        pass
-    
+            return True
+
     print(colorize("No more alternatives available", WARNING_COLOR))
     return False
 
 
-def main():
-    history = []
-    states_log = []
+def snapshot_state(state: dict) -> dict:
+    """
+    Copy of the turn state for the session log. Only the dicts that are
+    updated in place (atributes_bn, candidates, last_recommendation) are
+    copied; rankings and TMDB items are always replaced, never mutated,
+    so the snapshot can share them.
+    """
+    snapshot = dict(state)
+    for key in ("atributes_bn", "candidates", "last_recommendation"):
+        if snapshot.get(key) is not None:
+            snapshot[key] = dict(snapshot[key])
+    return snapshot
 
-    state = {
-        "atributes_bn": {},
-        "candidates": {},
-        "last_recommendation": None,
-        "user_feedback": None,
-        "real_content": [],  # Real content from TMDB
-        "content_index": 0,   # Track which content we're recommending
-        "content_available": False  # Flag for content availability
-    }
 
-    print("🎬 TV Assistant with Real Content. Type 'exit' to quit.\n")
+def load_bn(counts_path: Path) -> tuple:
+    """
+    Load the BN and re-apply the learned CPT counts from previous sessions
 
-    model = load_model("main/output/model.pkl")
+    Returns:
+        Tuple of (model, cpt_counts)
+    """
+    model_dir = Path("main/output/model")
+    model = load_model(str(model_dir) if model_dir.exists() else "main/output/model.pkl")
 
     # Initialize CPT counts
     cpt_counts = initialize_cpt_counts(model, virtual_sample_size=100)
 
-    from feedback import build_cpd_from_counts
-    counts_path = Path(__file__).parent / "output/cpt_counts.json"
     if counts_path.exists():
         try:
             cpt_counts = load_cpt_counts(counts_path)
             # Rebuild CPDs from loaded counts and apply to model
             for var, cpt_info in cpt_counts.items():
-                new_cpd = build_cpd_from_counts(var, cpt_info)
-                existing = model.get_cpds(var)
-                if existing:
-                    model.remove_cpds(existing)
-                model.add_cpds(new_cpd)
+                refresh_model_cpd(model, var, cpt_info)
             print("Loaded previous learning data\n")
         except Exception as e:
             print(f"Could not load previous counts: {e}\n")
@@ -223,6 +259,31 @@ def main():
         # First run: persist the initial counts so feedback can append from the start
         save_cpt_counts(cpt_counts, counts_path)
 
+    precompile_recommendation(model)
+    return model, cpt_counts
+
+
+async def run_session():
+    history = []
+    state_log = StateLogWriter(Path(__file__).parent / "output/states.jsonl")
+
+    state = {
+        "atributes_bn": {},
+        "candidates": {},
+        "last_recommendation": None,
+        "user_feedback": None,
+        "real_content": [],  # Real content from TMDB
+        "content_index": 0,   # Track which content we're recommending
+        "content_available": False  # Flag for content availability
+    }
+
+    print("🎬 TV Assistant with Real Content. Type 'exit' to quit.\n")
+
+    # The BN loads on a worker thread while the user types the first message
+    counts_path = Path(__file__).parent / "output/cpt_counts.json"
+    bn_loading = asyncio.create_task(asyncio.to_thread(load_bn, counts_path))
+    model = cpt_counts = None
+
     # Initialize TMDB content fetcher
     try:
         content_fetcher = TMDBContentFetcher()
@@ -234,17 +295,22 @@ def main():
         content_fetcher = None
 
     while True:
-        mensaje = input("User: ")
+        mensaje = await asyncio.to_thread(input, "User: ")
+
+        if model is None:
+            model, cpt_counts = await bn_loading
 
         if mensaje.lower().strip() == "exit":
             break
 
-        intent = classify_intent(mensaje)
-        intent_msg = f"Detected intent: {intent}"
-        print(colorize(intent_msg, INTENT_COLORS.get(intent, "")))
+        # Intent and attributes are requested concurrently; attributes are
+        # only used on RECOMMEND turns
+        intent, extracted = await aclassify_and_extract(mensaje)
+        pre, post = INTENT_LINE.get(intent, ("", ""))
+        print(f"{pre}Detected intent: {intent}{post}")
 
         if intent == "RECOMMEND":
-            atributes = extract_attributes_llm(mensaje)
+            atributes = extracted
             time_of_day, day_type = get_time_daytype()
 
             atributes["TimeOfDay"] = time_of_day
@@ -295,9 +361,9 @@ def main():
             save_cpt_counts(cpt_counts, counts_path)
             
             # Check if user is rejecting the entire genre
-            from smart_alternative import should_skip_to_next_genre, get_next_different_genre
+            from smart_alternative import ashould_skip_to_next_genre, get_next_different_genre
             
-            skip_genre, rejected_genre = should_skip_to_next_genre(mensaje, state)
+            skip_genre, rejected_genre = await ashould_skip_to_next_genre(mensaje, state)
             
             if skip_genre and rejected_genre:
                 print(colorize(f"User rejected entire genre: {rejected_genre}", WARNING_COLOR))
@@ -334,17 +400,16 @@ def main():
                     genre_ranking = bn_result.get("genre_ranking", [])
                     current_genre = bn_result.get("ProgramGenre")
                     
-                    try:
-                        current_idx = genre_ranking.index(current_genre)
-                        if current_idx + 1 < len(genre_ranking):
-                            next_genre = genre_ranking[current_idx + 1]
-                            bn_result["ProgramGenre"] = next_genre
-                            state["candidates"] = bn_result
-                            if state.get("last_recommendation"):
-                                state["last_recommendation"]["ProgramGenre"] = next_genre
-                            print(colorize(f"Next genre: {next_genre}", CONTENT_COLOR))
-                    except (ValueError, IndexError):
+                    current_idx = ranking_position(genre_ranking, current_genre)
+                    if current_idx is None:
                         print(colorize("No more genre alternatives", WARNING_COLOR))
+                    elif current_idx + 1 < len(genre_ranking):
+                        next_genre = genre_ranking[current_idx + 1]
+                        bn_result["ProgramGenre"] = next_genre
+                        state["candidates"] = bn_result
+                        if state.get("last_recommendation"):
+                            state["last_recommendation"]["ProgramGenre"] = next_genre
+                        print(colorize(f"Next genre: {next_genre}", CONTENT_COLOR))
 
         elif intent == "FEEDBACK_POS":
             state["user_feedback"] = "accepted"
@@ -356,9 +421,9 @@ def main():
             state["user_feedback"] = "rejected"
             
             # Check if it's actually a genre rejection (reclassify)
-            from smart_alternative import should_skip_to_next_genre, get_next_different_genre
+            from smart_alternative import ashould_skip_to_next_genre, get_next_different_genre
             
-            skip_genre, rejected_genre = should_skip_to_next_genre(mensaje, state)
+            skip_genre, rejected_genre = await ashould_skip_to_next_genre(mensaje, state)
             
             if skip_genre and rejected_genre:
                 # It's actually a genre rejection, treat as ALTERNATIVE
@@ -378,37 +443,72 @@ def main():
         elif intent in ("SMALLTALK", "OTHER"):
             pass
 
-        states_log.append(json.loads(json.dumps(state, default=str)))
-
-        raw_response = converse(mensaje, state, history)
-
-        try:
-            response = json.loads(raw_response)
-        except Exception:
-            print("JSON ERROR:", raw_response)
-            continue
+        snapshot = snapshot_state(state)
+        snapshot["user_message"] = mensaje  # needed to replay the turn offline
+        state_log.write(snapshot)
+
+        # Trivial greetings/acceptances get a canned reply; everything else goes to converse
+        response = templated_reply(mensaje, intent, state)
+
+        # Stream the assistant message to the terminal as it is generated
+        streamed = []
+
+        def show_delta(text, action):
+            if not streamed:
+                action_tag = action if action else "UNKNOWN"
+                color = ACTION_COLORS.get(action, "") if COLOR_ENABLED else ""
+                print(f"{color}Assistant ({action_tag}): ", end="")
+            streamed.append(text)
+            print(text, end="", flush=True)
+
+        if response is None:
+            raw_response = await aconverse_stream(mensaje, state, history, on_delta=show_delta)
+            if streamed:
+                print(COLOR_RESET if COLOR_ENABLED else "")
+
+            try:
+                response = orjson.loads(raw_response)
+            except orjson.JSONDecodeError:
+                # One retry at temperature 0 in JSON mode instead of dropping the turn
+                print("JSON ERROR, retrying:", raw_response)
+                raw_response = await aconverse(mensaje, state, history, force_json=True)
+                try:
+                    response = orjson.loads(raw_response)
+                except orjson.JSONDecodeError:
+                    print("JSON ERROR:", raw_response)
+                    continue
+                streamed.clear()  # the retried reply is printed in full below
 
         action = response.get("action")
         message = response.get("message")
         item = response.get("item")
 
-        action_color = ACTION_COLORS.get(action, "")
-        action_tag = action if action else "UNKNOWN"
-        assistant_line = f"Assistant ({action_tag}): {message}"
-        print(colorize(assistant_line, action_color))
+        if not streamed:
+            action_color = ACTION_COLORS.get(action, "")
+            action_tag = action if action else "UNKNOWN"
+            assistant_line = f"Assistant ({action_tag}): {message}"
+            print(colorize(assistant_line, action_color))
 
         history.append({"role": "user", "content": mensaje})
         history.append({"role": "assistant", "content": message})
+        await acompact_history(history)
+
+    await aclose_clients()
+
+    print(colorize(f"LLM cache: {response_cache.stats()}", BN_LOG_COLOR))
+    print(colorize(f"BN cache: {bn_cache.stats()}", BN_LOG_COLOR))
 
     # Save CPT counts
     save_cpt_counts(cpt_counts, counts_path)
     print(f"\nLearning data saved")
 
-    save_path = Path(__file__).parent / "output/states.json"
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(states_log, f, indent=2, ensure_ascii=False)
+    state_log.close()
+    print("All states saved to states.jsonl")
 
-    print("All states saved to states.json")
+
+def main():
+    setup_logging()
+    asyncio.run(run_session())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+"""
+replay_batch.py
+
+Offline replay of logged conversation turns (output/states.jsonl) through the
+OpenAI Batch API. Useful for prompt-regression runs after editing a prompt:
+every turn is re-sent to the intent, extraction and converse prompts in one
+server-side batch (cheaper than synchronous calls, no client concurrency).
+
+Usage:
+    python replay_batch.py submit [states.jsonl]  # prints the batch id
+    python replay_batch.py collect <batch_id>      # waits and saves the results
+"""
+
+import json
+import sys
+import time
+from pathlib import Path
+
+from LLM_agent import (
+    CONVERSE_JSON_MODE,
+    CONVERSE_MAX_TOKENS,
+    CONVERSE_MODEL,
+    EXTRACTION_MAX_TOKENS,
+    EXTRACTION_MODEL,
+    EXTRACTION_RESPONSE_FORMAT,
+    INTENT_MAX_TOKENS,
+    INTENT_MODEL,
+    INTENT_RESPONSE_FORMAT,
+    _converse_messages,
+    _extraction_messages,
+    _intent_messages,
+    get_client,
+)
+
+OUTPUT_DIR = Path(__file__).parent / "output"
+STATES_PATH = OUTPUT_DIR / "states.jsonl"
+RESULTS_PATH = OUTPUT_DIR / "replay_results.json"
+
+ENDPOINT = "/v1/chat/completions"
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+# ============================================================================
+# Build batch requests
+# ============================================================================
+
+def load_turns(path=STATES_PATH) -> list:
+    """
+    Load logged turns, keeping only those that recorded the user message.
+    Reads the JSONL session log, or a JSON list from older sessions (states.json).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if str(path).endswith(".jsonl"):
+            states = [json.loads(line) for line in f if line.strip()]
+        else:
+            states = json.load(f)
+    return [s for s in states if s.get("user_message")]
+
+
+def _request(custom_id: str, body: dict) -> dict:
+    return {"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": body}
+
+
+def build_requests(turns: list) -> list:
+    """
+    One intent, one extraction and one converse request per logged turn.
+    History is not logged, so converse is replayed with the state only.
+    """
+    requests = []
+    for i, turn in enumerate(turns):
+        message = turn["user_message"]
+        state = {k: v for k, v in turn.items() if k != "user_message"}
+
+        requests.append(_request(f"turn_{i}_intent", {
+            "model": INTENT_MODEL,
+            "messages": _intent_messages(message),
+            "temperature": 0,
+            "response_format": INTENT_RESPONSE_FORMAT,
+            "max_tokens": INTENT_MAX_TOKENS,
+        }))
+        requests.append(_request(f"turn_{i}_extraction", {
+            "model": EXTRACTION_MODEL,
+            "messages": _extraction_messages(message),
+            "temperature": 0,
+            "response_format": EXTRACTION_RESPONSE_FORMAT,
+            "max_tokens": EXTRACTION_MAX_TOKENS,
+        }))
+        converse_body = {
+            "model": CONVERSE_MODEL,
+            "messages": _converse_messages(message, state),
+            "temperature": 0.3,
+            "max_tokens": CONVERSE_MAX_TOKENS,
+        }
+        if CONVERSE_JSON_MODE:
+            converse_body["response_format"] = {"type": "json_object"}
+        requests.append(_request(f"turn_{i}_converse", converse_body))
+    return requests
+
+
+# ============================================================================
+# Submit / collect
+# ============================================================================
+
+def submit_batch(requests: list) -> str:
+    """Upload the requests as JSONL and create the batch. Returns the batch id."""
+    payload = "\n".join(json.dumps(r, ensure_ascii=False) for r in requests)
+    batch_file = get_client().files.create(
+        file=("replay.jsonl", payload.encode("utf-8")),
+        purpose="batch",
+    )
+    batch = get_client().batches.create(
+        input_file_id=batch_file.id,
+        endpoint=ENDPOINT,
+        completion_window="24h",
+    )
+    return batch.id
+
+
+def wait_for_batch(batch_id: str, poll_seconds: int = 30):
+    batch = get_client().batches.retrieve(batch_id)
+    while batch.status not in FINAL_STATUSES:
+        print(f"Batch {batch_id}: {batch.status} ({batch.request_counts.completed}/{batch.request_counts.total})")
+        time.sleep(poll_seconds)
+        batch = get_client().batches.retrieve(batch_id)
+    return batch
+
+
+def collect_results(batch_id: str) -> dict:
+    """
+    Wait for the batch and map custom_id -> parsed response content
+    (the raw string when the content is not valid JSON)
+    """
+    batch = wait_for_batch(batch_id)
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"Batch {batch_id} finished with status '{batch.status}'")
+
+    results = {}
+    for line in get_client().files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        body = (record.get("response") or {}).get("body") or {}
+        choices = body.get("choices") or []
+        content = choices[0]["message"]["content"] if choices else None
+        try:
+            results[record["custom_id"]] = json.loads(content)
+        except (TypeError, json.JSONDecodeError):
+            results[record["custom_id"]] = content
+    return results
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("submit", "collect"):
+        print(__doc__)
+        sys.exit(1)
+
+    if sys.argv[1] == "submit":
+        path = sys.argv[2] if len(sys.argv) > 2 else STATES_PATH
+        turns = load_turns(path)
+        batch_id = submit_batch(build_requests(turns))
+        print(f"Submitted {len(turns)} turns as batch {batch_id}")
+    else:
+        results = collect_results(sys.argv[2])
+        with open(RESULTS_PATH, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"{len(results)} results saved to {RESULTS_PATH}")
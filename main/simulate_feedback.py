@@ -9,10 +9,12 @@ Usage:
 """
 
 import copy
-import itertools
+import logging
 import sys
 import os
 
+import numpy as np
+
 sys.path.insert(0, os.path.dirname(__file__))
 
 import feedback as fb
@@ -62,9 +64,7 @@ def viewing_to_feedback(percent_watched, times_watched=1, duration_minutes=None)
 # Session simulation
 # ============================================================================
 
-def simulate_session(
-    model,
-    cpt_counts,
+def build_session_state(
     program_type,
     program_genre,
     percent_watched,
@@ -73,11 +73,9 @@ def simulate_session(
     context_attrs=None,
 ):
     """
-    Build an artificial state and call apply_feedback.
+    Build the artificial state for one viewing session.
 
     Args:
-        model:            Loaded DiscreteBayesianNetwork.
-        cpt_counts:       In-memory CPT counts (modified in place).
         program_type:     e.g. "movie", "series", "news" ...
         program_genre:    e.g. "comedy", "drama", "documentary" ...
         percent_watched:  0-100 float.
@@ -89,7 +87,7 @@ def simulate_session(
                           expansion by apply_feedback internally).
 
     Returns:
-        The feedback params dict that was applied, or None if no feedback.
+        The state dict (carrying its own "learning_rate"), or None if no feedback.
     """
     feedback_params = viewing_to_feedback(percent_watched, times_watched, duration_minutes)
 
@@ -113,8 +111,15 @@ def simulate_session(
     if context_attrs:
         attrs_bn.update(context_attrs)
 
-    state = {
+    print(
+        f"[simulate] {program_type}/{program_genre} @ {percent_watched:.0f}% "
+        f"(x{times_watched}) -> {feedback_params['user_feedback']}, "
+        f"lr={feedback_params['learning_rate']}"
+    )
+
+    return {
         "user_feedback": feedback_params["user_feedback"],
+        "learning_rate": feedback_params["learning_rate"],
         "last_recommendation": {
             "ProgramType": program_type,
             "ProgramGenre": program_genre,
@@ -122,14 +127,42 @@ def simulate_session(
         "atributes_bn": attrs_bn,
     }
 
-    print(
-        f"[simulate] {program_type}/{program_genre} @ {percent_watched:.0f}% "
-        f"(x{times_watched}) -> {feedback_params['user_feedback']}, "
-        f"lr={feedback_params['learning_rate']}"
-    )
 
-    fb.apply_feedback(model, cpt_counts, state, learning_rate=feedback_params["learning_rate"])
-    return feedback_params
+def simulate_session(model, cpt_counts, **session):
+    """
+    Build an artificial state and call apply_feedback.
+
+    Args:
+        model:      Loaded DiscreteBayesianNetwork.
+        cpt_counts: In-memory CPT counts (modified in place).
+        session:    Keyword arguments for build_session_state.
+
+    Returns:
+        The state that was applied, or None if no feedback.
+    """
+    state = build_session_state(**session)
+    if state is None:
+        return None
+
+    fb.apply_feedback(model, cpt_counts, state, learning_rate=state["learning_rate"])
+    return state
+
+
+def simulate_sessions(model, cpt_counts, sessions):
+    """
+    Simulate many viewing sessions at once through apply_feedback_batch,
+    so each touched CPD is refreshed only once.
+
+    Args:
+        model:      Loaded DiscreteBayesianNetwork.
+        cpt_counts: In-memory CPT counts (modified in place).
+        sessions:   Iterable of keyword-argument dicts for build_session_state.
+
+    Returns:
+        Number of sessions that carried feedback.
+    """
+    states = [state for state in (build_session_state(**s) for s in sessions) if state is not None]
+    return fb.apply_feedback_batch(model, cpt_counts, states)
 
 
 # ============================================================================
@@ -146,18 +179,16 @@ def _counts_to_probs(cpt_info, variable):
     state_names = cpt_info["state_names"]
     parents = cpt_info["parents"]
     var_states = state_names[variable]
-
-    if parents:
-        parent_combos = list(itertools.product(*[state_names[p] for p in parents]))
-    else:
-        parent_combos = [()]
+    counts = cpt_info["counts"]
 
     probs = {}
-    for parent_state in parent_combos:
-        total = sum(cpt_info["counts"][parent_state].values())
+    for parent_idx in np.ndindex(counts.shape[1:]):
+        parent_state = tuple(state_names[p][i] for p, i in zip(parents, parent_idx))
+        column = counts[(slice(None),) + parent_idx]
+        total = column.sum()
         if total > 0:
             probs[parent_state] = {
-                s: cpt_info["counts"][parent_state][s] / total for s in var_states
+                s: column[i] / total for i, s in enumerate(var_states)
             }
         else:
             n = len(var_states)
@@ -230,7 +261,7 @@ def print_cpd_diff(cpt_counts_before, cpt_counts_after, variable):
 
 
 # ============================================================================
-# Deep-copy helper (handles defaultdict-based cpt_counts)
+# Deep-copy helper (copies the counts arrays)
 # ============================================================================
 
 def snapshot_counts(cpt_counts):
@@ -243,6 +274,9 @@ def snapshot_counts(cpt_counts):
 # ============================================================================
 
 if __name__ == "__main__":
+    # Show the per-event feedback log lines in this dev tool
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+
     MODEL_PATH = os.path.join(os.path.dirname(__file__), "output", "model.pkl")
 
     print("Loading model ...")
@@ -337,3 +371,17 @@ if __name__ == "__main__":
 
     print_cpd_diff(before_5, cpt_counts, "ProgramType")
     print_cpd_diff(before_5, cpt_counts, "ProgramGenre")
+
+    # -----------------------------------------------------------------------
+    # Example 6 – A day of viewing applied as one batch
+    # -----------------------------------------------------------------------
+    before_6 = snapshot_counts(cpt_counts)
+
+    simulate_sessions(model, cpt_counts, [
+        {"program_type": "series", "program_genre": "comedy", "percent_watched": 100},
+        {"program_type": "movie", "program_genre": "action", "percent_watched": 85},
+        {"program_type": "news", "program_genre": "news", "percent_watched": 20},
+    ])
+
+    print_cpd_diff(before_6, cpt_counts, "ProgramType")
+    print_cpd_diff(before_6, cpt_counts, "ProgramGenre")
@@ -3,53 +3,156 @@ Smart alternative selection with genre rejection detection
 Integrates with main.py to handle explicit genre rejections
 """
 
-import json
+import functools
+import logging
 import os
-from openai import OpenAI
-from dotenv import load_dotenv
+import re
+from concurrent.futures import ThreadPoolExecutor
 
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+import orjson
 
+from LLM_agent import (  # shared HTTP/2 pools, LLM cache and genre lexicon
+    GENRE_SYNONYMS,
+    get_aclient,
+    get_client,
+    normalize_message,
+    response_cache,
+)
 
+# Genre-switch progress; silent unless the caller attaches a handler (main.py
+# does, coloring records by their "style": "warning" or "content")
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+WARNING_STYLE = {"style": "warning"}
+CONTENT_STYLE = {"style": "content"}
+
+# Narrow JSON classification, like intent/extraction in LLM_agent: small model, short output
+GENRE_REJECTION_MODEL = os.getenv("GENRE_REJECTION_MODEL", "gpt-4o-mini")
+GENRE_REJECTION_MAX_TOKENS = 80
+# A failed detection silently keeps the genre, so transient errors (429, 5xx,
+# timeouts, dropped connections) get more SDK retries (jittered exponential
+# backoff) than the client default of 2 before falling back
+GENRE_REJECTION_MAX_RETRIES = 3
+# Routes these requests to the same prompt-cache shard (see PROMPT_CACHE_KEY in LLM_agent)
+GENRE_REJECTION_CACHE_KEY = "genre-rejection-v1"
+
+
+# The JSON shape and the genre names are enforced by GENRE_REJECTION_RESPONSE_FORMAT;
+# the prompt only has to separate genre rejections from title rejections
 GENRE_REJECTION_PROMPT = """
-Analiza el mensaje del usuario para detectar si está rechazando explícitamente un GÉNERO específico.
+¿El usuario rechaza un GÉNERO (rejects_genre=true, rejected_genre en inglés) o solo el título propuesto (false, null)?
+Género: "No me gusta el drama" → drama; "Nada de terror" → horror.
+Título: "Esa no", "Otra opción", "Muy larga" → null.
+reason: breve explicación.
+""".strip()
+
+GENRES = [
+    "comedy", "drama", "horror", "romance", "action", "thriller", "sci-fi", "fantasy",
+    "documentary", "news", "entertainment",
+]
 
-Devuelve SOLO un JSON válido:
-{
-  "rejects_genre": true/false,
-  "rejected_genre": "nombre del género rechazado o null",
-  "reason": "breve explicación"
+# rejected_genre is constrained to the BN genre names (or null) at decode time
+GENRE_REJECTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "rejects_genre": {"type": "boolean"},
+        "rejected_genre": {"type": ["string", "null"], "enum": GENRES + [None]},
+        "reason": {"type": "string"},
+    },
+    "required": ["rejects_genre", "rejected_genre", "reason"],
+    "additionalProperties": False,
 }
 
-Ejemplos de RECHAZO DE GÉNERO (rejects_genre=true):
-- "No me gusta el drama" → rejected_genre: "drama"
-- "Nada de terror" → rejected_genre: "horror"
-- "No quiero ver comedias" → rejected_genre: "comedy"
-- "Algo que no sea romántico" → rejected_genre: "romance"
-- "No me van los documentales" → rejected_genre: "documentary"
+GENRE_REJECTION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "genre_rejection", "strict": True, "schema": GENRE_REJECTION_SCHEMA},
+}
+
+GENRE_REJECTION_BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "genre_rejections",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"results": {"type": "array", "items": GENRE_REJECTION_SCHEMA}},
+            "required": ["results"],
+            "additionalProperties": False,
+        },
+    },
+}
 
-Ejemplos de RECHAZO DE CONTENIDO ESPECÍFICO (rejects_genre=false):
-- "Esa no" → rejected_genre: null (rechaza el título, no el género)
-- "Otra opción" → rejected_genre: null
-- "No me convence" → rejected_genre: null
-- "Muy larga" → rejected_genre: null
+# Local fast path for the common short phrasings, on normalize_message() text.
+# Only a whole-phrase GENRE_SYNONYMS match is trusted ("no quiero ver comedias
+# románticas" still goes to the LLM).
 
-Géneros válidos:
-- comedy, drama, horror, romance, action, thriller, sci-fi, fantasy
-- documentary, news, entertainment
+_GENRE_REJECTION_PATTERN = re.compile(
+    r"(?:no me (?:gusta|gustan|va|van)|nada de|no quiero(?: ver)?|odio|algo que no sea)"
+    r"(?: (?:el|la|los|las|de|un|una))? (.+)"
+)
 
-No añadas texto fuera del JSON.
-"""
+# Rejections of the title, never of the genre
+_CONTENT_REJECTIONS = frozenset((
+    "esa no", "no esa", "otra", "otra opción", "otra opcion", "dame otra", "dame otra opción",
+    "dame otra opcion", "siguiente", "no me convence", "muy larga", "muy corta",
+))
+
+
+def fast_detect_genre_rejection(user_message: str):
+    """
+    Answer obvious genre/title rejections locally
+
+    Returns:
+        Detection dict, or None if the message needs the LLM
+    """
+    text = normalize_message(user_message)
+    if text in _CONTENT_REJECTIONS:
+        return {"rejects_genre": False, "rejected_genre": None, "reason": "fast path: title rejection"}
+
+    match = _GENRE_REJECTION_PATTERN.fullmatch(text)
+    if match:
+        genre = GENRE_SYNONYMS.get(match.group(1))
+        if genre:
+            return {"rejects_genre": True, "rejected_genre": genre, "reason": "fast path: genre rejection"}
+    return None
 
 
-def detect_genre_rejection(user_message: str, current_genre: str) -> dict:
+def _rejection_messages(user_message: str, current_genre: str) -> list:
+    return [
+        {"role": "system", "content": GENRE_REJECTION_PROMPT},
+        {"role": "user", "content": f"Mensaje: '{user_message}'\nGénero actual: {current_genre}"}
+    ]
+
+
+def _rejection_key(user_message: str, current_genre: str, model: str) -> str:
+    return response_cache.make_key(
+        model, GENRE_REJECTION_PROMPT, normalize_message(user_message), current_genre or ""
+    )
+
+
+def _rejection_from_response(key: str, content: str) -> dict:
+    result = orjson.loads(content)
+    response_cache.set(key, result)
+    return result
+
+
+def _rejection_error(e: Exception) -> dict:
+    print(f"Error detecting genre rejection: {e}")
+    return {
+        "rejects_genre": False,
+        "rejected_genre": None,
+        "reason": "Error in detection"
+    }
+
+
+def detect_genre_rejection(user_message: str, current_genre: str, model: str = GENRE_REJECTION_MODEL) -> dict:
     """
     Detect if user is rejecting a specific genre
     
     Args:
         user_message: User's response
         current_genre: Currently recommended genre
+        model: Chat model used when the local fast path does not apply
         
     Returns:
         {
@@ -58,26 +161,130 @@ def detect_genre_rejection(user_message: str, current_genre: str) -> dict:
             "reason": str
         }
     """
+    fast = fast_detect_genre_rejection(user_message)
+    if fast is not None:
+        return fast
+
+    key = _rejection_key(user_message, current_genre, model)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        response = get_client().with_options(max_retries=GENRE_REJECTION_MAX_RETRIES).chat.completions.create(
+            model=model,
+            messages=_rejection_messages(user_message, current_genre),
+            temperature=0,
+            response_format=GENRE_REJECTION_RESPONSE_FORMAT,
+            max_tokens=GENRE_REJECTION_MAX_TOKENS,
+            prompt_cache_key=GENRE_REJECTION_CACHE_KEY,
+        )
+        return _rejection_from_response(key, response.choices[0].message.content)
+    
+    except Exception as e:
+        return _rejection_error(e)
+
+
+async def adetect_genre_rejection(user_message: str, current_genre: str, model: str = GENRE_REJECTION_MODEL) -> dict:
+    """Async version of detect_genre_rejection (uses the AsyncOpenAI client)"""
+    fast = fast_detect_genre_rejection(user_message)
+    if fast is not None:
+        return fast
+
+    key = _rejection_key(user_message, current_genre, model)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        response = await get_aclient().with_options(max_retries=GENRE_REJECTION_MAX_RETRIES).chat.completions.create(
+            model=model,
+            messages=_rejection_messages(user_message, current_genre),
+            temperature=0,
+            response_format=GENRE_REJECTION_RESPONSE_FORMAT,
+            max_tokens=GENRE_REJECTION_MAX_TOKENS,
+            prompt_cache_key=GENRE_REJECTION_CACHE_KEY,
+        )
+        return _rejection_from_response(key, response.choices[0].message.content)
+
+    except Exception as e:
+        return _rejection_error(e)
+
+
+GENRE_REJECTION_BATCH_SUFFIX = """
+
+Recibirás VARIOS casos numerados, uno por línea ("0: Mensaje: '...' | Género actual: ...").
+Analiza cada uno por separado y responde SOLO con JSON: {"results": [{...}, ...]},
+con exactamente un objeto por caso, con los mismos campos y en el mismo orden.
+"""
+
+
+def detect_genre_rejection_batch(items: list, model: str = GENRE_REJECTION_MODEL) -> list:
+    """
+    Detect genre rejections for many (user_message, current_genre) pairs with
+    a single API call (evaluation runs, offline use). Fast-path and cached
+    pairs are resolved locally; the rest share one request and one prompt.
+
+    Returns:
+        List of detection dicts, aligned with items
+    """
+    keys = [_rejection_key(message, genre, model) for message, genre in items]
+    results = [
+        fast_detect_genre_rejection(message) or response_cache.get(key)
+        for (message, _), key in zip(items, keys)
+    ]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        return results
+
+    listing = "\n".join(
+        f"{n}: Mensaje: '{' '.join(items[i][0].split())}' | Género actual: {items[i][1]}"
+        for n, i in enumerate(pending)
+    )
+    try:
+        response = get_client().with_options(max_retries=GENRE_REJECTION_MAX_RETRIES).chat.completions.create(
+            model=model,
             messages=[
-                {"role": "system", "content": GENRE_REJECTION_PROMPT},
-                {"role": "user", "content": f"Mensaje: '{user_message}'\nGénero actual: {current_genre}"}
+                {"role": "system", "content": GENRE_REJECTION_PROMPT + GENRE_REJECTION_BATCH_SUFFIX},
+                {"role": "user", "content": listing},
             ],
-            temperature=0
+            temperature=0,
+            response_format=GENRE_REJECTION_BATCH_RESPONSE_FORMAT,
+            max_tokens=GENRE_REJECTION_MAX_TOKENS * len(pending),
+            prompt_cache_key=GENRE_REJECTION_CACHE_KEY,
         )
+        batch = orjson.loads(response.choices[0].message.content).get("results", [])
+    except Exception as e:
+        print(f"Error detecting genre rejection batch: {e}")
+        batch = []
+
+    if len(batch) != len(pending):
+        print(f"Rejection batch returned {len(batch)} of {len(pending)} results; detecting one by one")
+        batch = [detect_genre_rejection(*items[i], model=model) for i in pending]
+    else:
+        for i, result in zip(pending, batch):
+            response_cache.set(keys[i], result)
+
+    for i, result in zip(pending, batch):
+        results[i] = result
+    return results
+
+
+def canonical_genre(genre: str) -> str:
+    """BN genre name for a Spanish/English, singular/plural genre word"""
+    genre = genre.strip().lower()
+    return GENRE_SYNONYMS.get(genre, genre)
+
+
+def _skip_decision(detection: dict, current_genre: str) -> tuple:
+    if detection["rejects_genre"] and detection["rejected_genre"]:
+        rejected = canonical_genre(detection["rejected_genre"])
         
-        result = json.loads(response.choices[0].message.content)
-        return result
+        # Only a rejection of the genre being recommended skips it
+        if rejected == canonical_genre(current_genre):
+            return True, rejected
     
-    except Exception as e:
-        print(f"Error detecting genre rejection: {e}")
-        return {
-            "rejects_genre": False,
-            "rejected_genre": None,
-            "reason": "Error in detection"
-        }
+    return False, None
 
 
 def should_skip_to_next_genre(user_message: str, state: dict) -> tuple:
@@ -96,16 +303,54 @@ def should_skip_to_next_genre(user_message: str, state: dict) -> tuple:
     if not current_genre:
         return False, None
     
-    detection = detect_genre_rejection(user_message, current_genre)
-    
-    if detection["rejects_genre"]:
-        rejected = detection["rejected_genre"]
-        
-        # Verify rejected genre matches current genre (or is similar)
-        if rejected and (rejected == current_genre or rejected in current_genre or current_genre in rejected):
-            return True, rejected
-    
-    return False, None
+    return _skip_decision(detect_genre_rejection(user_message, current_genre), current_genre)
+
+
+async def ashould_skip_to_next_genre(user_message: str, state: dict) -> tuple:
+    """Async version of should_skip_to_next_genre"""
+    current_genre = state.get("candidates", {}).get("ProgramGenre")
+
+    if not current_genre:
+        return False, None
+
+    return _skip_decision(await adetect_genre_rejection(user_message, current_genre), current_genre)
+
+
+# Genres whose TMDB content is requested concurrently when skipping ahead
+PREFETCH_GENRES = 3
+# Threads are started on first submit; the fetcher's session and cache are shared
+_prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_GENRES, thread_name_prefix="genre-prefetch")
+
+
+def _fetch_genre_content(content_fetcher, program_type: str, program_genre: str) -> list:
+    """Worker: TMDB content for one genre, [] on any error"""
+    if not program_type or not program_genre:
+        return []
+    try:
+        return content_fetcher.get_content_by_recommendation(
+            program_type=program_type,
+            program_genre=program_genre,
+            limit=10,
+            language="es-ES"
+        )
+    except Exception as e:
+        logger.warning("Error fetching content for %s: %s", program_genre, e, extra=WARNING_STYLE)
+        return []
+
+
+@functools.lru_cache(maxsize=1)
+def _fetch_real_content():
+    """
+    main.fetch_real_content, imported on first use: main imports this
+    module, so it cannot be imported at load time
+    """
+    from main import fetch_real_content
+    return fetch_real_content
+
+
+def ranking_position(ranking: list, value):
+    """Position of value in a BN ranking, or None if it is not ranked"""
+    return {v: i for i, v in enumerate(ranking)}.get(value)
 
 
 def get_next_different_genre(state: dict, content_fetcher, rejected_genre: str = None):
@@ -120,77 +365,78 @@ def get_next_different_genre(state: dict, content_fetcher, rejected_genre: str =
     Returns:
         bool: True if found alternative, False otherwise
     """
-    from main import fetch_real_content, colorize, CONTENT_COLOR, WARNING_COLOR
+    fetch_real_content = _fetch_real_content()
     
     bn_result = state.get("candidates", {})
+    last_rec = state.get("last_recommendation")
     genre_ranking = bn_result.get("genre_ranking", [])
     current_genre = bn_result.get("ProgramGenre")
     
-    # Find current position in ranking
-    try:
-        current_idx = genre_ranking.index(current_genre)
-    except ValueError:
-        current_idx = 0
+    # Find current position in ranking (a genre outside it counts as the top)
+    current_idx = ranking_position(genre_ranking, current_genre) or 0
     
-    # Try next genres in ranking
-    for next_idx in range(current_idx + 1, len(genre_ranking)):
-        next_genre = genre_ranking[next_idx]
-        
+    # Try next genres in ranking; the next PREFETCH_GENRES are requested from
+    # TMDB concurrently and taken in ranking order
+    candidates = []
+    for next_genre in genre_ranking[current_idx + 1:]:
         # Skip if this is the rejected genre
         if rejected_genre and next_genre == rejected_genre:
-            print(colorize(f"   Skipping rejected genre: {next_genre}", WARNING_COLOR))
+            logger.info("   Skipping rejected genre: %s", next_genre, extra=WARNING_STYLE)
             continue
+        candidates.append(next_genre)
+
+    program_type = bn_result.get("ProgramType")
+    for start in range(0, len(candidates), PREFETCH_GENRES):
+        window = candidates[start:start + PREFETCH_GENRES]
+        futures = [
+            _prefetch_pool.submit(_fetch_genre_content, content_fetcher, program_type, genre)
+            for genre in window
+        ]
+        for next_genre, future in zip(window, futures):
+            logger.info("   Trying next genre: %s", next_genre, extra=WARNING_STYLE)
+            new_content = future.result()
+
+            if new_content:
+                # Update BN result
+                bn_result["ProgramGenre"] = next_genre
+                state["real_content"] = new_content
+                state["content_index"] = 0
+                state["candidates"] = bn_result
+
+                if last_rec:
+                    last_rec["ProgramGenre"] = next_genre
+                    last_rec["content"] = new_content[0]
+
+                logger.info("Switched to genre: %s (%d items)", next_genre, len(new_content), extra=CONTENT_STYLE)
+                return True
+    
+    # If no genres left, try different type
+    logger.info("No more genres, trying different type...", extra=WARNING_STYLE)
+    type_ranking = bn_result.get("type_ranking", [])
+    current_type = bn_result.get("ProgramType")
+    
+    current_type_idx = ranking_position(type_ranking, current_type)
+    if current_type_idx is not None and current_type_idx + 1 < len(type_ranking):
+        next_type = type_ranking[current_type_idx + 1]
+        logger.info("   Trying type: %s", next_type, extra=WARNING_STYLE)
         
-        print(colorize(f"   Trying next genre: {next_genre}", WARNING_COLOR))
-        
-        # Update BN result
-        bn_result["ProgramGenre"] = next_genre
+        bn_result["ProgramType"] = next_type
+        bn_result["ProgramGenre"] = genre_ranking[0] if genre_ranking else current_genre
         
-        # Fetch new content
-        new_content = fetch_real_content(bn_result, content_fetcher, limit=10, fallback_to_alternatives=False)
+        new_content = fetch_real_content(bn_result, content_fetcher, limit=10, fallback_to_alternatives=True)
         
         if new_content:
             state["real_content"] = new_content
             state["content_index"] = 0
             state["candidates"] = bn_result
             
-            if state.get("last_recommendation"):
-                state["last_recommendation"]["ProgramGenre"] = next_genre
-                state["last_recommendation"]["content"] = new_content[0]
+            if last_rec:
+                last_rec["ProgramType"] = next_type
+                last_rec["ProgramGenre"] = bn_result["ProgramGenre"]
+                last_rec["content"] = new_content[0]
             
-            print(colorize(f"Switched to genre: {next_genre}", CONTENT_COLOR))
             return True
     
-    # If no genres left, try different type
-    print(colorize("No more genres, trying different type...", WARNING_COLOR))
-    type_ranking = bn_result.get("type_ranking", [])
-    current_type = bn_result.get("ProgramType")
-    
-    try:
-        current_type_idx = type_ranking.index(current_type)
-        if current_type_idx + 1 < len(type_ranking):
-            next_type = type_ranking[current_type_idx + 1]
-            print(colorize(f"   Trying type: {next_type}", WARNING_COLOR))
-            
-            bn_result["ProgramType"] = next_type
-            bn_result["ProgramGenre"] = genre_ranking[0] if genre_ranking else current_genre
-            
-            new_content = fetch_real_content(bn_result, content_fetcher, limit=10, fallback_to_alternatives=True)
-            
-            if new_content:
-                state["real_content"] = new_content
-                state["content_index"] = 0
-                state["candidates"] = bn_result
-                
-                if state.get("last_recommendation"):
-                    state["last_recommendation"]["ProgramType"] = next_type
-                    state["last_recommendation"]["ProgramGenre"] = bn_result["ProgramGenre"]
-                    state["last_recommendation"]["content"] = new_content[0]
-                
-                return True
-    except (ValueError, IndexError):
-        pass
-    
     return False
 
 
@@ -205,8 +451,7 @@ if __name__ == "__main__":
         ("No quiero ver comedias románticas", "romance"),
     ]
     
-    for message, genre in test_cases:
-        result = detect_genre_rejection(message, genre)
+    for (message, genre), result in zip(test_cases, detect_genre_rejection_batch(test_cases)):
         print(f"\nMessage: '{message}'")
         print(f"Current genre: {genre}")
         print(f"Result: {result}")
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""
+state_log.py
+
+Append-only log of per-turn state snapshots (one JSON object per line).
+
+Snapshots are queued by the conversation loop and serialized/written by a
+background thread, so the turn never waits on disk I/O and the session
+does not keep every snapshot in memory. The file is appended to across
+sessions and flushed whenever the queue drains, so a crash loses at most
+the turn being written.
+"""
+
+import queue
+import threading
+
+import orjson
+
+_STOP = object()
+
+
+class StateLogWriter:
+    """
+    Background JSONL writer fed through a queue
+    """
+
+    def __init__(self, path, buffer_size: int = 8192):
+        """
+        Args:
+            path: Output .jsonl file (appended to)
+            buffer_size: Write buffer size in bytes
+        """
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._file = open(path, "ab", buffering=buffer_size)
+        self._thread = threading.Thread(target=self._run, name="state-log", daemon=True)
+        self._thread.start()
+
+    def write(self, snapshot: dict) -> None:
+        """Queue a snapshot; it must not be mutated afterwards"""
+        self._queue.put(snapshot)
+
+    def _run(self) -> None:
+        while True:
+            snapshot = self._queue.get()
+            if snapshot is _STOP:
+                break
+            self._file.write(orjson.dumps(
+                snapshot,
+                default=str,
+                option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS,
+            ))
+            if self._queue.empty():
+                self._file.flush()
+        self._file.close()
+
+    def close(self) -> None:
+        """Flush pending snapshots and wait for the writer thread"""
+        self._queue.put(_STOP)
+        self._thread.join()
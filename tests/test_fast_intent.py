@@ -0,0 +1,39 @@
+import pytest
+
+from LLM_agent import fast_classify_intent
+
+
+@pytest.mark.parametrize("message", [
+    "Nada de terror",
+    "nada de comedias",
+    "nada de ciencia ficción, por favor",
+    "Nada de documentales",
+    "nada de películas",
+    "nada de series",
+])
+def test_nada_de_genre_or_type_is_alternative(message):
+    assert fast_classify_intent(message) == "ALTERNATIVE"
+
+
+@pytest.mark.parametrize("message", [
+    "nada de momento",
+    "nada de nuevo",
+    "nada de eso",
+])
+def test_nada_de_other_words_go_to_llm(message):
+    assert fast_classify_intent(message) is None
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("¡Hola!", "SMALLTALK"),
+    ("Vale", "FEEDBACK_POS"),
+    ("No me convence", "FEEDBACK_NEG"),
+    ("Dame otra opción", "ALTERNATIVE"),
+])
+def test_trivial_messages(message, intent):
+    assert fast_classify_intent(message) == intent
+
+
+@pytest.mark.parametrize("message", ["No me gusta el drama", "Quiero ver comedia"])
+def test_sentences_are_never_short_circuited(message):
+    assert fast_classify_intent(message) is None